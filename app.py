@@ -1,13 +1,22 @@
 # app.py - Versão Web do Analisador NFe para Render/Streamlit
 import streamlit as st
 import pandas as pd
-import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from datetime import datetime
+import importlib.util
 import os
+import sqlite3
 import tempfile
+import time
 import zipfile
-from datetime import datetime
-from io import BytesIO
-import base64
+
+from nfe_analyzer import NFeAnalyzer
+from nfe_cache import NoteCache
+from nfe_jobs import JobManager, ERRO
+from nfe_ncmbase import NCM_REGISTRY
+from nfe_reconcile import BUCKETS, DIVERGENCES
+from nfe_explorer import EXPLORER_COLUMNS, PAGE_SIZE
+from nfe_watch import FileIndex, FolderWatcher
 
 # Configuração da página
 st.set_page_config(
@@ -16,453 +25,324 @@ st.set_page_config(
     layout="wide"
 )
 
-class NFeAnalyzer:
-    def __init__(self):
-        self.ncm_database = {}
-        self.sefaz_autorizadas = {}
-        self.sefaz_canceladas = {}
-        self.sefaz_denegadas = {}
-        self.sefaz_entrada = {}
-        self.xmls_database = {}
-        self.processed_data = []
-        self.excluded_data = []
-        self.xmls_nao_encontrados = []
+@st.cache_resource
+def get_note_cache():
+    """Cache persistente de notas compartilhado por todas as sessões"""
+    try:
+        return NoteCache.from_env()
+    except (OSError, sqlite3.Error):
+        return None
+
+@st.cache_resource
+def get_preloaded_ncm_base():
+    """Base NCM do servidor (NFE_NCM_FILE), lida uma vez e compartilhada pelas sessões"""
+    path = os.environ.get('NFE_NCM_FILE')
+    if not path:
+        return None
+    try:
+        return NCM_REGISTRY.preload(path)
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_file_index():
+    """Índice persistente dos arquivos da pasta monitorada (NFE_WATCH_DIR)"""
+    try:
+        return FileIndex.default()
+    except (OSError, sqlite3.Error):
+        return None
+
+def get_folder_watcher(analyzer, directory):
+    """Watcher da pasta para o analyzer da sessão (guarda o que já foi registrado)"""
+    watcher = st.session_state.get('folder_watcher')
+    if watcher is None or watcher.analyzer is not analyzer or watcher.directory != os.path.abspath(directory):
+        index = get_file_index()
+        if index is None:
+            return None
+        watcher = st.session_state.folder_watcher = FolderWatcher(directory, analyzer, index)
+    return watcher
+
+@st.cache_resource
+def get_job_manager():
+    """Jobs de análise do processo, independentes da sessão do navegador"""
+    return JobManager()
+
+def get_job_param():
+    """Id do job guardado na URL (permite retomar após reconectar)"""
+    if hasattr(st, 'query_params'):
+        return st.query_params.get('job')
+    return st.experimental_get_query_params().get('job', [None])[0]
+
+def set_job_param(job_id):
+    if hasattr(st, 'query_params'):
+        st.query_params['job'] = job_id
+    else:
+        st.experimental_set_query_params(job=job_id)
+
+def run_analysis(analyzer, profile=False, progress=None):
+    """Executa a análise na thread do job (o cProfile só mede essa thread)"""
+    profiling = analyzer.diagnostics.profile() if profile else nullcontext()
+    with profiling:
+        return analyzer.process_analysis(progress)
+
+# Intervalo de atualização da página enquanto um job executa (segundos)
+JOB_POLL_INTERVAL = 1.0
+
+# Formatos extras de exportação: rótulo -> (formato, extensão, mime)
+EXPORT_FORMATS = {
+    'Parquet': ('parquet', '.parquet', 'application/vnd.apache.parquet'),
+    'CSV gzip': ('csv', '.csv.gz', 'application/gzip'),
+}
+# Parquet só é oferecido com o pyarrow instalado
+if importlib.util.find_spec('pyarrow') is None:
+    del EXPORT_FORMATS['Parquet']
+
+# Abas de detalhamento dos resultados: (dimensão, título)
+BREAKDOWN_TABS = [
+    ('ncm', "Por NCM"),
+    ('cfop', "Por CFOP"),
+    ('cnpj', "Por Emitente"),
+    ('mes', "Por Mês"),
+]
+
+# Notas exibidas por lista da conciliação (o download traz todas)
+RECONCILIATION_PREVIEW_ROWS = 1000
+
+EXPORT_PARTITIONS = {
+    'Sem partição': None,
+    'Classificação': 'classificacao',
+    'CNPJ do emitente': 'cnpj',
+}
+
+
+def export_download(analyzer, label, partition_by):
+    """(bytes, extensão, mime) da exportação; partições vão num ZIP"""
+    fmt, extension, mime = EXPORT_FORMATS[label]
+    with tempfile.TemporaryDirectory() as directory:
+        if partition_by is None:
+            path = os.path.join(directory, 'analise' + extension)
+            analyzer.generate_export(fmt, path)
+            with open(path, 'rb') as f:
+                return f.read(), extension, mime
         
-    def load_ncm_database(self, excel_file):
-        """Carrega a base de dados de NCMs do arquivo Excel"""
-        try:
-            df = pd.read_excel(excel_file, sheet_name=0, header=1)
-            if len(df) < 10:  # Tentar header=0 se poucos dados
-                df = pd.read_excel(excel_file, sheet_name=0, header=0)
-            
-            # Identificar colunas
-            ncm_col = None
-            class_col = None
-            
-            for col in df.columns:
-                if 'NCM' in str(col).upper():
-                    ncm_col = col
-                    break
-            
-            for col in df.columns:
-                if any(term in str(col).upper() for term in ['MONOFASICO', 'MONOFÁSICO', 'PIS', 'COFINS']):
-                    class_col = col
-                    break
-            
-            if not ncm_col or not class_col:
-                ncm_col = 0
-                class_col = 4
-            
-            count_monofasico = 0
-            count_tributado = 0
-            
-            for index, row in df.iterrows():
-                try:
-                    if isinstance(ncm_col, int):
-                        ncm_value = row.iloc[ncm_col] if len(row) > ncm_col else None
-                        class_value = row.iloc[class_col] if len(row) > class_col else None
-                    else:
-                        ncm_value = row[ncm_col] if ncm_col in row else None
-                        class_value = row[class_col] if class_col in row else None
-                    
-                    if pd.notna(ncm_value) and pd.notna(class_value):
-                        if isinstance(ncm_value, (int, float)):
-                            ncm = str(int(ncm_value)).zfill(8)
-                        else:
-                            ncm = str(ncm_value).replace('.', '').replace('-', '').strip().zfill(8)
-                        
-                        classificacao = str(class_value).strip()
-                        self.ncm_database[ncm] = classificacao
-                        
-                        if 'monofasico' in classificacao.lower() or 'monofásico' in classificacao.lower():
-                            count_monofasico += 1
-                        elif 'tributado' in classificacao.lower():
-                            count_tributado += 1
-                        
-                except:
-                    continue
-            
-            return True, len(self.ncm_database), count_monofasico, count_tributado
-            
-        except Exception as e:
-            return False, str(e), 0, 0
-    
-    def load_sefaz_database(self, csv_file):
-        """Carrega e categoriza todas as notas da SEFAZ"""
-        try:
-            # Tentar diferentes separadores
-            df = None
-            for sep in [',', ';', '\t']:
-                try:
-                    df = pd.read_csv(csv_file, sep=sep)
-                    if len(df.columns) > 5:
-                        break
-                except:
-                    csv_file.seek(0)  # Reset file pointer
-                    continue
-            
-            if df is None or len(df.columns) < 2:
-                # Tentar com encoding diferente
-                csv_file.seek(0)
-                df = pd.read_csv(csv_file, encoding='latin-1')
-            
-            # Identificar colunas
-            chave_col = None
-            situacao_col = None
-            tipo_op_col = None
-            valor_col = None
-            
-            for col in df.columns:
-                col_clean = str(col).upper().replace(' ', '')
-                if 'CHAVE' in col_clean and 'ACESSO' in col_clean:
-                    chave_col = col
-                elif 'SITUACAO' in col_clean or 'SITUAÇÃO' in col_clean:
-                    situacao_col = col
-                elif 'TIPO' in col_clean and 'OPERACAO' in col_clean:
-                    tipo_op_col = col
-                elif 'VALOR' in col_clean:
-                    valor_col = col
-            
-            if not chave_col or not situacao_col:
-                return False, "Colunas essenciais não encontradas!", 0, 0, 0, 0
-            
-            # Contadores
-            count_autorizadas_saida = 0
-            count_canceladas = 0
-            count_denegadas = 0
-            count_entrada = 0
-            
-            valor_autorizadas = 0
-            valor_canceladas = 0
-            valor_denegadas = 0
-            valor_entrada = 0
-            
-            # Processar cada linha
-            for index, row in df.iterrows():
-                try:
-                    chave = str(row[chave_col]).strip() if pd.notna(row[chave_col]) else ''
-                    situacao = str(row[situacao_col]).strip() if pd.notna(row[situacao_col]) else ''
-                    tipo_op = str(row[tipo_op_col]).strip() if tipo_op_col and pd.notna(row[tipo_op_col]) else 'Saida'
-                    
-                    # Extrair valor
-                    valor = 0
-                    if valor_col and pd.notna(row[valor_col]):
-                        try:
-                            valor_str = str(row[valor_col]).replace('R$', '').replace('.', '').replace(',', '.').strip()
-                            valor = float(valor_str)
-                        except:
-                            valor = 0
-                    
-                    # Limpar chave
-                    chave_limpa = ''.join(c for c in chave if c.isdigit())
-                    
-                    if len(chave_limpa) == 44:
-                        dados = {
-                            'chave': chave_limpa,
-                            'situacao': situacao,
-                            'tipo_operacao': tipo_op,
-                            'valor': valor
-                        }
-                        
-                        situacao_upper = situacao.upper()
-                        tipo_upper = tipo_op.upper()
-                        
-                        if 'AUTORIZADA' in situacao_upper:
-                            if 'SAIDA' in tipo_upper or 'SAÍDA' in tipo_upper:
-                                self.sefaz_autorizadas[chave_limpa] = dados
-                                count_autorizadas_saida += 1
-                                valor_autorizadas += valor
-                            else:
-                                self.sefaz_entrada[chave_limpa] = dados
-                                count_entrada += 1
-                                valor_entrada += valor
-                        elif 'CANCELADA' in situacao_upper:
-                            self.sefaz_canceladas[chave_limpa] = dados
-                            count_canceladas += 1
-                            valor_canceladas += valor
-                        elif 'DENEGADA' in situacao_upper:
-                            self.sefaz_denegadas[chave_limpa] = dados
-                            count_denegadas += 1
-                            valor_denegadas += valor
-                            
-                except:
-                    continue
-            
-            return True, count_autorizadas_saida, valor_autorizadas, count_canceladas, valor_canceladas, count_entrada, valor_entrada
-            
-        except Exception as e:
-            return False, str(e), 0, 0, 0, 0
-    
-    def process_xml_files(self, xml_files):
-        """Processa lista de arquivos XML"""
-        xmls_processados = 0
+        folder = os.path.join(directory, 'analise')
+        files = analyzer.generate_export(fmt, folder, partition_by)
+        zip_path = os.path.join(directory, 'analise.zip')
+        # Parquet e gzip já são compactados
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zf:
+            for path in files:
+                zf.write(path, os.path.relpath(path, folder))
+        with open(zip_path, 'rb') as f:
+            return f.read(), f"_{fmt}.zip", 'application/zip'
+
+
+def render_diagnostics(analyzer):
+    """Expander com tempo/memória por etapa, contadores de falhas e perfil"""
+    report = analyzer.diagnostics.to_dict()
+    with st.expander("🩺 Diagnóstico"):
+        if report['stages']:
+            st.dataframe(pd.DataFrame(report['stages']), use_container_width=True)
+        else:
+            st.info("Nenhuma etapa executada ainda")
+        
+        if report['counters']:
+            st.markdown("**Falhas ignoradas**")
+            st.table(pd.DataFrame(list(report['counters'].items()), columns=['Contador', 'Quantidade']))
         
-        for xml_file in xml_files:
-            try:
-                content = xml_file.read()
-                chave = self.extract_chave_from_xml_content(content)
-                
-                if chave and len(chave) == 44:
-                    self.xmls_database[chave] = content
-                    xmls_processados += 1
-            except:
-                continue
+        if report['profile']:
+            st.markdown("**Perfil (cProfile) da última captura**")
+            st.code(report['profile'])
         
-        return xmls_processados
+        st.download_button(
+            label="📥 Baixar diagnóstico (JSON)",
+            data=analyzer.diagnostics_json(),
+            file_name=f"diagnostico_nfe_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json"
+        )
+
+
+def render_reconciliation(analyzer, job):
+    """Totais da conciliação SEFAZ x XMLs e as listas de divergências"""
+    conciliacao = analyzer.reconcile()
+    st.markdown("### 🔀 Conciliação SEFAZ x XMLs")
+    st.dataframe(conciliacao.summary(), use_container_width=True, hide_index=True)
     
-    def extract_chave_from_xml_content(self, xml_content):
-        """Extrai chave de conteúdo XML"""
-        try:
-            if isinstance(xml_content, bytes):
-                xml_content = xml_content.decode('utf-8', errors='ignore')
-            
-            root = ET.fromstring(xml_content)
-            
-            # Procurar chave
-            for elem in root.iter():
-                if elem.tag.endswith('}infNFe') or elem.tag == 'infNFe':
-                    id_attr = elem.get('Id', '')
-                    if id_attr.startswith('NFe'):
-                        chave = id_attr[3:]
-                        return ''.join(c for c in chave if c.isdigit())
-                    elif len(id_attr) == 44:
-                        return ''.join(c for c in id_attr if c.isdigit())
-            
-            # Procurar por chNFe
-            for elem in root.iter():
-                if elem.tag.endswith('}chNFe') or elem.tag == 'chNFe':
-                    chave = elem.text.strip() if elem.text else ''
-                    return ''.join(c for c in chave if c.isdigit())
-            
-            return None
-            
-        except:
-            return None
+    grupos = [name for name in DIVERGENCES if conciliacao.count(name)]
+    if not grupos:
+        return
     
-    def classify_product(self, ncm):
-        """Classifica produto por NCM"""
-        if not ncm:
-            return 'Indefinido'
-        
-        clean_ncm = str(ncm).replace('.', '').replace('-', '').strip().zfill(8)
-        
-        if clean_ncm in self.ncm_database:
-            classificacao = self.ncm_database[clean_ncm]
-            
-            if 'monofasico' in classificacao.lower() or 'monofásico' in classificacao.lower():
-                return 'Monofásico'
-            elif 'tributado' in classificacao.lower():
-                return 'Tributado'
-            else:
-                return classificacao
-        
-        return 'Indefinido'
+    downloads = st.session_state.setdefault('reconciliation_downloads', {})
+    if downloads.get('job') != job.id:
+        downloads.clear()
+        downloads['job'] = job.id
     
-    def extract_products_from_xml(self, xml_content):
-        """Extrai produtos de XML"""
-        try:
-            if isinstance(xml_content, bytes):
-                xml_content = xml_content.decode('utf-8', errors='ignore')
-            
-            root = ET.fromstring(xml_content)
-            
-            def remove_namespace(tag):
-                return tag.split('}')[-1] if '}' in tag else tag
-            
-            def find_element_text(parent, tag_name):
-                for elem in parent.iter():
-                    if remove_namespace(elem.tag) == tag_name:
-                        return elem.text.strip() if elem.text else ''
-                return ''
-            
-            def find_element_float(parent, tag_name):
-                text = find_element_text(parent, tag_name)
-                try:
-                    return float(text) if text else 0.0
-                except:
-                    return 0.0
-            
-            produtos = []
-            for elem in root.iter():
-                if remove_namespace(elem.tag) == 'det':
-                    prod_element = None
-                    
-                    for sub_elem in elem.iter():
-                        if remove_namespace(sub_elem.tag) == 'prod':
-                            prod_element = sub_elem
-                            break
-                    
-                    if prod_element is not None:
-                        ncm = find_element_text(prod_element, 'NCM')
-                        descricao = find_element_text(prod_element, 'xProd')
-                        quantidade = find_element_float(prod_element, 'qCom')
-                        valor_unitario = find_element_float(prod_element, 'vUnCom')
-                        valor_produto = find_element_float(prod_element, 'vProd')
-                        unidade = find_element_text(prod_element, 'uCom')
-                        cfop = find_element_text(prod_element, 'CFOP')
-                        
-                        if ncm and valor_produto > 0:
-                            classificacao = self.classify_product(ncm)
-                            
-                            produtos.append({
-                                'ncm': ncm,
-                                'descricao': descricao or 'Produto sem descrição',
-                                'classificacao': classificacao,
-                                'quantidade': quantidade,
-                                'valor_unitario': valor_unitario,
-                                'valor_produto_xml': valor_produto,
-                                'unidade': unidade or 'UN',
-                                'cfop': cfop or ''
-                            })
-            
-            return produtos
-            
-        except:
-            return []
-    
-    def process_analysis(self):
-        """Processa análise baseada na SEFAZ"""
-        self.processed_data = []
-        self.xmls_nao_encontrados = []
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        total_items = len(self.sefaz_autorizadas)
-        processed = 0
-        
-        for chave, dados_sefaz in self.sefaz_autorizadas.items():
-            if chave in self.xmls_database:
-                xml_content = self.xmls_database[chave]
-                produtos = self.extract_products_from_xml(xml_content)
-                
-                if produtos:
-                    valor_nota_sefaz = dados_sefaz['valor']
-                    num_produtos = len(produtos)
-                    valor_por_produto = valor_nota_sefaz / num_produtos if num_produtos > 0 else 0
-                    
-                    for produto in produtos:
-                        produto.update({
-                            'chave_nfe': chave,
-                            'valor_nota_sefaz': valor_nota_sefaz,
-                            'valor_produto_proporcional': valor_por_produto,
-                            'status': 'Autorizada + Saída'
-                        })
-                        self.processed_data.append(produto)
-            else:
-                self.xmls_nao_encontrados.append({
-                    'chave': chave,
-                    'valor': dados_sefaz['valor'],
-                    'situacao': dados_sefaz['situacao'],
-                    'motivo': 'XML não encontrado'
-                })
-            
-            processed += 1
-            progress_bar.progress(processed / total_items)
-            status_text.text(f"Processando... {processed}/{total_items}")
-        
-        progress_bar.empty()
-        status_text.empty()
-        
-        return len(self.processed_data), len(self.xmls_nao_encontrados)
+    abas = st.tabs([f"{BUCKETS[name]} ({conciliacao.count(name)})" for name in grupos])
+    for aba, name in zip(abas, grupos):
+        with aba:
+            lista = conciliacao.frame(name)
+            if len(lista) > RECONCILIATION_PREVIEW_ROWS:
+                st.caption(f"Exibindo {RECONCILIATION_PREVIEW_ROWS} de {len(lista)} notas; "
+                           "o CSV traz a lista completa")
+            st.dataframe(lista.head(RECONCILIATION_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+            if name not in downloads:
+                downloads[name] = lista.to_csv(index=False).encode('utf-8')
+            st.download_button(
+                label="📥 Baixar lista (CSV)",
+                data=downloads[name],
+                file_name=f"conciliacao_{name}.csv",
+                mime="text/csv",
+                key=f"conciliacao_{name}"
+            )
+
+
+def render_explorer(analyzer, job):
+    """Produtos filtrados e ordenados no servidor; só a página atual vai para o navegador"""
+    st.markdown("### 📋 Explorar Produtos")
+    indice = analyzer.results_index()
     
-    def generate_detailed_excel(self):
-        """Gera Excel detalhado com formatação"""
-        if not self.processed_data:
-            return None
-        
-        # Preparar dados
-        export_data = []
-        for item in self.processed_data:
-            export_data.append({
-                'Nome do Produto': item['descricao'],
-                'Valor Total': item['valor_produto_proporcional'],
-                'NCM': item['ncm'],
-                'Classificação': item['classificacao'],
-                'Quantidade': item['quantidade'],
-                'Valor Unitário': item['valor_unitario'],
-                'Nota Fiscal': f"NFe_{item['chave_nfe']}",
-                'CFOP': item.get('cfop', ''),
-                'Unidade': item.get('unidade', 'UN'),
-                'Observações': f"Encontrado na base oficial - {item['status']}"
-            })
-        
-        # Criar Excel em memória
-        output = BytesIO()
-        
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df = pd.DataFrame(export_data)
-            df.to_excel(writer, sheet_name='Análise Detalhada', index=False)
-            
-            # Formatação
-            workbook = writer.book
-            worksheet = writer.sheets['Análise Detalhada']
-            
-            # Formatos
-            header_format = workbook.add_format({
-                'bold': True,
-                'text_wrap': True,
-                'valign': 'center',
-                'align': 'center',
-                'bg_color': '#366092',
-                'font_color': 'white',
-                'border': 1
-            })
-            
-            money_format = workbook.add_format({
-                'num_format': 'R$ #,##0.00',
-                'border': 1
-            })
-            
-            # Aplicar formatação
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            
-            # Largura das colunas
-            worksheet.set_column('A:A', 50)
-            worksheet.set_column('B:B', 15)
-            worksheet.set_column('C:C', 10)
-            worksheet.set_column('D:D', 15)
-            worksheet.set_column('E:E', 12)
-            worksheet.set_column('F:F', 15)
-            worksheet.set_column('G:G', 45)
-            worksheet.set_column('H:H', 8)
-            worksheet.set_column('I:I', 10)
-            worksheet.set_column('J:J', 40)
-            
-            # Adicionar resumo
-            self.add_summary_sheet(writer)
-        
-        output.seek(0)
-        return output
-    
-    def add_summary_sheet(self, writer):
-        """Adiciona planilha de resumo"""
-        summary_data = {
-            'Categoria': [],
-            'Quantidade': [],
-            'Valor Total': [],
-            'Percentual': []
-        }
-        
-        valor_total = sum(item['valor_produto_proporcional'] for item in self.processed_data)
-        
-        for classificacao in ['Monofásico', 'Tributado', 'Indefinido']:
-            itens = [item for item in self.processed_data if item['classificacao'] == classificacao]
-            if itens:
-                valor = sum(item['valor_produto_proporcional'] for item in itens)
-                summary_data['Categoria'].append(classificacao)
-                summary_data['Quantidade'].append(len(itens))
-                summary_data['Valor Total'].append(valor)
-                summary_data['Percentual'].append((valor / valor_total * 100) if valor_total > 0 else 0)
-        
-        summary_data['Categoria'].append('TOTAL GERAL')
-        summary_data['Quantidade'].append(len(self.processed_data))
-        summary_data['Valor Total'].append(valor_total)
-        summary_data['Percentual'].append(100.0)
-        
-        df_summary = pd.DataFrame(summary_data)
-        df_summary.to_excel(writer, sheet_name='Resumo', index=False)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        classificacao = st.multiselect("Classificação", indice.values('classificacao'), key='explorer_classificacao')
+        ncm_prefix = st.text_input("NCM começa com", key='explorer_ncm')
+    with col2:
+        cfop = st.multiselect("CFOP", indice.values('cfop'), key='explorer_cfop')
+        chave = st.text_input("Chave contém", key='explorer_chave')
+    with col3:
+        texto = st.text_input("Descrição contém", key='explorer_texto')
+        titulos = {titulo: col for col, titulo in EXPLORER_COLUMNS.items()}
+        ordem = titulos.get(st.selectbox("Ordenar por", ["Ordem original"] + list(titulos), key='explorer_ordem'))
+    decrescente = st.checkbox("Decrescente", key='explorer_decrescente')
+    
+    # Consulta refeita só quando filtros/ordem mudam; as demais reexecuções reaproveitam as linhas
+    consulta = (job.id, tuple(classificacao), tuple(cfop), ncm_prefix, chave, texto, ordem, decrescente)
+    cache = st.session_state.setdefault('explorer', {})
+    if cache.get('consulta') != consulta:
+        linhas = indice.query(classificacao, cfop, ncm_prefix, chave, texto)
+        cache['consulta'] = consulta
+        cache['linhas'] = indice.sort(linhas, ordem, not decrescente)
+    linhas = cache['linhas']
+    
+    paginas = max(1, -(-len(linhas) // PAGE_SIZE))
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        # A chave muda com a consulta, então a página volta para 1 a cada novo filtro
+        pagina = st.number_input("Página", min_value=1, max_value=paginas, value=1,
+                                 key=f"explorer_pagina_{hash(consulta)}")
+    with col2:
+        st.caption(f"{len(linhas):,} de {len(indice):,} produtos | página {pagina} de {paginas}")
+    st.dataframe(indice.page(linhas, pagina - 1, PAGE_SIZE), use_container_width=True)
+
+
+def render_results(analyzer, job, export_labels, export_partition):
+    """Resultados do job concluído: métricas, gráficos, detalhamento e downloads"""
+    produtos_count, xmls_nao_encontrados = job.result
+    
+    st.success(f"✅ Análise concluída em {job.elapsed:.1f}s! {produtos_count} produtos processados")
+    mudancas = analyzer.last_changes
+    st.caption(f"Notas recalculadas: {mudancas['novas']} novas, {mudancas['alteradas']} alteradas, "
+               f"{mudancas['removidas']} removidas"
+               + (" | base NCM alterada (produtos reclassificados)" if mudancas['ncm_alterada'] else ""))
+    
+    if xmls_nao_encontrados > 0:
+        st.warning(f"⚠️ {xmls_nao_encontrados} XMLs não encontrados")
+    
+    # Resultados
+    if not analyzer.processed_data:
+        return
+    
+    st.markdown("---")
+    st.markdown("## 📊 Resultados")
+    
+    # Métricas principais (todas da mesma agregação)
+    resumo = analyzer.summarize()
+    valor_total = resumo.valor_total
+    totais = resumo.totals('classificacao')
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("💰 Valor Total", f"R$ {valor_total:,.2f}")
+    with col2:
+        st.metric("📦 Total Produtos", resumo.itens)
+    
+    # Separar por classificação
+    qtd_monofasico, valor_monofasico = totais.get('Monofásico', (0, 0.0))
+    qtd_tributado, valor_tributado = totais.get('Tributado', (0, 0.0))
+    qtd_indefinido, valor_indefinido = totais.get('Indefinido', (0, 0.0))
+    
+    with col3:
+        st.metric("💚 Monofásico", 
+                 f"R$ {valor_monofasico:,.2f}", 
+                 f"{qtd_monofasico} itens")
+    with col4:
+        st.metric("🔴 Tributado", 
+                 f"R$ {valor_tributado:,.2f}",
+                 f"{qtd_tributado} itens")
+    
+    # Gráfico de pizza
+    st.markdown("### 📊 Distribuição por Classificação")
+    
+    import plotly.express as px
+    
+    df_pie = pd.DataFrame({
+        'Classificação': ['Monofásico', 'Tributado', 'Indefinido'],
+        'Valor': [valor_monofasico, valor_tributado, valor_indefinido]
+    })
+    df_pie = df_pie[df_pie['Valor'] > 0]
+    
+    fig = px.pie(df_pie, values='Valor', names='Classificação', 
+               color_discrete_map={'Monofásico': '#00CC00', 
+                                 'Tributado': '#FF4444',
+                                 'Indefinido': '#CCCCCC'})
+    st.plotly_chart(fig)
+    
+    # Detalhamentos
+    st.markdown("### 🔎 Detalhamento")
+    abas = st.tabs([titulo for _, titulo in BREAKDOWN_TABS])
+    for aba, (dimensao, _) in zip(abas, BREAKDOWN_TABS):
+        with aba:
+            st.dataframe(resumo.breakdowns[dimensao], use_container_width=True, hide_index=True)
+    
+    render_reconciliation(analyzer, job)
+    
+    render_explorer(analyzer, job)
+    
+    # Download
+    st.markdown("### 📥 Exportar Resultados")
+    
+    # Arquivos gerados só quando pedidos: os bytes valem para esta execução da
+    # página (o download) e não ficam guardados na sessão
+    timestamp = datetime.fromtimestamp(job.finished or time.time()).strftime('%Y%m%d_%H%M%S')
+    
+    if st.button("⚙️ Gerar Excel", use_container_width=True):
+        with st.spinner("Gerando Excel..."):
+            # Gerado em disco; só o arquivo final (compactado) vai para o download
+            with analyzer.generate_detailed_excel() as excel_file:
+                excel_bytes = excel_file.read()
+        st.download_button(
+            label="📥 Baixar Análise Detalhada (Excel)",
+            data=excel_bytes,
+            file_name=f"analise_detalhada_nfe_{timestamp}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+    
+    for label in export_labels:
+        if not st.button(f"⚙️ Gerar {label}", key=f"gerar_{label}", use_container_width=True):
+            continue
+        try:
+            with st.spinner(f"Gerando {label}..."):
+                data, extension, mime = export_download(analyzer, label, export_partition)
+        except ImportError as e:
+            st.warning(f"⚠️ {e}")
+            continue
+        st.download_button(
+            label=f"📥 Baixar Análise Detalhada ({label})",
+            data=data,
+            file_name=f"analise_detalhada_nfe_{timestamp}{extension}",
+            mime=mime,
+            use_container_width=True
+        )
+
 
 # Interface Streamlit
 def main():
@@ -475,28 +355,67 @@ def main():
         st.markdown("""
         1. **Base NCM**: Excel com NCMs e classificação tributária
         2. **SEFAZ**: CSV com dados das notas fiscais
-        3. **XMLs**: Arquivos XML das notas (múltiplos)
+        3. **XMLs**: Arquivos XML das notas (múltiplos) ou ZIPs com os XMLs
         
         O sistema irá:
         - ✅ Usar valores da SEFAZ
         - 📊 Classificar por NCM (Monofásico/Tributado)
         - 📥 Gerar relatório detalhado
         """)
+        
+        st.header("📦 Exportação")
+        export_labels = st.multiselect("Formatos extras", list(EXPORT_FORMATS))
+        export_partition = EXPORT_PARTITIONS[st.selectbox("Particionar por", list(EXPORT_PARTITIONS))]
+        
+        st.header("🩺 Diagnóstico")
+        show_diagnostics = st.checkbox("Mostrar diagnóstico")
+        trace_memory = st.checkbox("Medir memória com tracemalloc (mais lento)")
+        profile_run = st.checkbox("Capturar perfil (cProfile) da análise")
+    
+    # Job da sessão (ou do link, após reconectar) e analyzer
+    jobs = get_job_manager()
+    job_id = st.session_state.get('job_id') or get_job_param()
+    job = jobs.get(job_id)
+    if job is None and job_id and getattr(st.session_state.get('job'), 'id', None) == job_id:
+        # Já descartado da lista do processo: status e resultado ficam na sessão
+        job = st.session_state.job
+    if job is not None and 'analyzer' not in st.session_state:
+        if job.context is None:
+            st.info("ℹ️ O resultado deste link expirou; carregue os arquivos e processe a análise novamente")
+            job = None
+        else:
+            st.session_state.analyzer = job.context
+            st.session_state.job_id = job.id
     
-    # Inicializar analyzer
     if 'analyzer' not in st.session_state:
-        st.session_state.analyzer = NFeAnalyzer()
+        st.session_state.analyzer = NFeAnalyzer(note_cache=get_note_cache())
+        base_servidor = get_preloaded_ncm_base()
+        if base_servidor is not None:
+            st.session_state.analyzer.use_ncm_base(base_servidor)
     
     analyzer = st.session_state.analyzer
+    if job is not None and job.context is not analyzer:
+        job = None
+    if job is not None:
+        st.session_state.job = job
+    running = job is not None and not job.done
+    if not running:
+        analyzer.diagnostics.trace_memory = trace_memory
     
     # Upload de arquivos
+    if running:
+        st.info("⏳ Análise em andamento: arquivos enviados agora serão carregados quando ela terminar")
     col1, col2, col3 = st.columns(3)
     
     with col1:
         st.markdown("### 📊 Base NCM")
+        base_servidor = get_preloaded_ncm_base()
+        if base_servidor is not None and any(base is base_servidor for base in analyzer.ncm_bases):
+            st.caption(f"Base do servidor: {len(base_servidor)} NCMs (versão {base_servidor.version[:8]}); "
+                       "um Excel enviado complementa essa base")
         ncm_file = st.file_uploader("Selecione o Excel", type=['xlsx', 'xls'], key='ncm')
         
-        if ncm_file:
+        if ncm_file and not running:
             result = analyzer.load_ncm_database(ncm_file)
             if result[0]:
                 st.success(f"✅ {result[1]} NCMs carregados")
@@ -508,7 +427,7 @@ def main():
         st.markdown("### 📋 Base SEFAZ")
         sefaz_file = st.file_uploader("Selecione o CSV", type=['csv'], key='sefaz')
         
-        if sefaz_file:
+        if sefaz_file and not running:
             result = analyzer.load_sefaz_database(sefaz_file)
             if result[0]:
                 st.success(f"✅ {result[1]} notas autorizadas")
@@ -520,12 +439,30 @@ def main():
         st.markdown("### 📁 XMLs NFe")
         xml_files = st.file_uploader("Selecione os XMLs", type=['xml'], accept_multiple_files=True, key='xmls')
         
-        if xml_files:
+        if xml_files and not running:
             xmls_count = analyzer.process_xml_files(xml_files)
             st.success(f"✅ {xmls_count} XMLs processados")
+        
+        zip_files = st.file_uploader("Ou envie ZIPs com os XMLs", type=['zip'], accept_multiple_files=True, key='zips')
+        
+        if zip_files and not running:
+            zip_count = analyzer.process_zip_files(zip_files)
+            st.success(f"✅ {zip_count} XMLs extraídos dos ZIPs")
+        
+        pasta = os.environ.get('NFE_WATCH_DIR')
+        if pasta and st.button("🔄 Ler pasta do servidor", disabled=running, help=pasta):
+            watcher = get_folder_watcher(analyzer, pasta)
+            if watcher is None:
+                st.error("❌ Índice de arquivos indisponível (verifique NFE_CACHE_DIR)")
+            else:
+                with st.spinner("Lendo pasta..."):
+                    contagem = watcher.refresh()
+                st.success(f"✅ {contagem['notas']} XMLs na pasta")
+                st.info(f"Lidos agora: {contagem['lidos']} ({contagem['novos']} novos, "
+                        f"{contagem['alterados']} alterados) | Removidos: {contagem['removidos']}")
     
     # Botão processar
-    if st.button("🎯 Processar Análise", type="primary", use_container_width=True):
+    if st.button("🎯 Processar Análise", type="primary", use_container_width=True, disabled=running):
         if not analyzer.ncm_database:
             st.error("❌ Carregue a base NCM primeiro!")
         elif not analyzer.sefaz_autorizadas:
@@ -533,80 +470,31 @@ def main():
         elif not analyzer.xmls_database:
             st.error("❌ Carregue os XMLs primeiro!")
         else:
-            with st.spinner("Processando..."):
-                produtos_count, xmls_nao_encontrados = analyzer.process_analysis()
-                
-            st.success(f"✅ Análise concluída! {produtos_count} produtos processados")
-            
-            if xmls_nao_encontrados > 0:
-                st.warning(f"⚠️ {xmls_nao_encontrados} XMLs não encontrados")
-            
-            # Resultados
-            if analyzer.processed_data:
-                st.markdown("---")
-                st.markdown("## 📊 Resultados")
-                
-                # Métricas principais
-                valor_total = sum(item['valor_produto_proporcional'] for item in analyzer.processed_data)
-                
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("💰 Valor Total", f"R$ {valor_total:,.2f}")
-                with col2:
-                    st.metric("📦 Total Produtos", len(analyzer.processed_data))
-                
-                # Separar por classificação
-                monofasicos = [p for p in analyzer.processed_data if p['classificacao'] == 'Monofásico']
-                tributados = [p for p in analyzer.processed_data if p['classificacao'] == 'Tributado']
-                indefinidos = [p for p in analyzer.processed_data if p['classificacao'] == 'Indefinido']
-                
-                valor_monofasico = sum(p['valor_produto_proporcional'] for p in monofasicos)
-                valor_tributado = sum(p['valor_produto_proporcional'] for p in tributados)
-                valor_indefinido = sum(p['valor_produto_proporcional'] for p in indefinidos)
-                
-                with col3:
-                    st.metric("💚 Monofásico", 
-                             f"R$ {valor_monofasico:,.2f}", 
-                             f"{len(monofasicos)} itens")
-                with col4:
-                    st.metric("🔴 Tributado", 
-                             f"R$ {valor_tributado:,.2f}",
-                             f"{len(tributados)} itens")
-                
-                # Gráfico de pizza
-                st.markdown("### 📊 Distribuição por Classificação")
-                
-                import plotly.express as px
-                
-                df_pie = pd.DataFrame({
-                    'Classificação': ['Monofásico', 'Tributado', 'Indefinido'],
-                    'Valor': [valor_monofasico, valor_tributado, valor_indefinido]
-                })
-                df_pie = df_pie[df_pie['Valor'] > 0]
-                
-                fig = px.pie(df_pie, values='Valor', names='Classificação', 
-                           color_discrete_map={'Monofásico': '#00CC00', 
-                                             'Tributado': '#FF4444',
-                                             'Indefinido': '#CCCCCC'})
-                st.plotly_chart(fig)
-                
-                # Preview dos dados
-                st.markdown("### 📋 Preview dos Dados")
-                df_preview = pd.DataFrame(analyzer.processed_data[:10])
-                st.dataframe(df_preview[['descricao', 'ncm', 'classificacao', 'valor_produto_proporcional']])
-                
-                # Download
-                st.markdown("### 📥 Exportar Resultados")
-                
-                excel_file = analyzer.generate_detailed_excel()
-                if excel_file:
-                    st.download_button(
-                        label="📥 Baixar Análise Detalhada (Excel)",
-                        data=excel_file,
-                        file_name=f"analise_detalhada_nfe_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True
-                    )
+            job = jobs.submit(run_analysis, analyzer, profile_run, description="Análise NFe x SEFAZ",
+                              context=analyzer)
+            st.session_state.job_id = job.id
+            st.session_state.job = job
+            set_job_param(job.id)
+            running = True
+    
+    if job is not None:
+        if not job.done:
+            st.progress(job.progress.fraction)
+            st.text(job.progress.message or "Iniciando análise...")
+            st.caption(f"Job {job.id} em execução há {job.elapsed:.0f}s — pode fechar ou recarregar a página")
+        elif job.status == ERRO:
+            st.error("❌ Erro na análise")
+            st.code(job.error)
+        else:
+            render_results(analyzer, job, export_labels, export_partition)
+    
+    if show_diagnostics and not running:
+        render_diagnostics(analyzer)
+    
+    if running:
+        # Acompanha o job sem bloquear: nova leitura do andamento a cada intervalo
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+# bench.py - Benchmark das etapas do NFeAnalyzer com dados sintéticos
+#
+# Exemplo (na raiz do projeto):
+#   python -m benchmarks.bench --sizes 1000 10000 100000 --output bench.json
+#   python -m benchmarks.bench --sizes 10000 --compare bench.json
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
+
+from benchmarks.synthetic import generate_dataset
+from nfe_analyzer import NFeAnalyzer
+from nfe_diagnostics import PeakMemory, current_rss
+from nfe_ncmbase import NCMRegistry
+
+DEFAULT_SIZES = [1_000, 10_000]
+
+
+def _mb(value):
+    return round(value / 2**20, 1) if value is not None else None
+
+
+def measure(func, count, unit):
+    """Executa func e devolve o resultado e as métricas da etapa
+
+    Sem leitura da memória residente (Windows), o pico vem do tracemalloc
+    (só as alocações do Python, e mais lento).
+    """
+    gc.collect()
+    traced = current_rss() is None
+    if traced:
+        tracemalloc.start()
+    try:
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] if traced else None
+    finally:
+        if traced:
+            tracemalloc.stop()
+    return result, {
+        'seconds': round(seconds, 4),
+        'count': count,
+        'unit': unit,
+        'throughput': round(count / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': _mb(memory.peak),
+        'rss_growth_mb': _mb(memory.growth),
+        'tracemalloc_peak_mb': _mb(traced_peak),
+    }
+
+
+def max_rss(who='RUSAGE_SELF'):
+    """Pico de memória residente em MB (getrusage); None sem o módulo resource"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(getattr(resource, who)).ru_maxrss
+    return _mb(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+def iter_zip_files(path):
+    """Arquivos XML do ZIP como uploads (a descompactação entra no tempo)"""
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            yield io.BytesIO(zf.read(name))
+
+
+def run_size(notes, data_dir, seed=0, workers=None, excel=True):
+    """Gera/reaproveita os dados de um tamanho e mede cada etapa"""
+    manifest = generate_dataset(os.path.join(data_dir, f"notes_{notes}_seed_{seed}"), notes, seed)
+    paths = manifest['paths']
+    # Registro próprio: a base NCM é lida de novo em cada tamanho medido
+    analyzer = NFeAnalyzer(workers=workers, ncm_registry=NCMRegistry())
+    stages = {}
+
+    result, stages['load_ncm_database'] = measure(
+        lambda: analyzer.load_ncm_database(paths['ncm.xlsx']), manifest['ncm_rows'], 'lines/s')
+    if not result[0]:
+        raise RuntimeError(f"Erro na base NCM: {result[1]}")
+
+    result, stages['load_sefaz_database'] = measure(
+        lambda: analyzer.load_sefaz_database(paths['sefaz.csv']), manifest['sefaz_rows'], 'lines/s')
+    if not result[0]:
+        raise RuntimeError(f"Erro no CSV SEFAZ: {result[1]}")
+
+    _, stages['process_xml_files'] = measure(
+        lambda: analyzer.process_xml_files(iter_zip_files(paths['xmls.zip'])),
+        manifest['xml_files'], 'notes/s')
+
+    _, stages['process_analysis'] = measure(
+        analyzer.process_analysis, len(analyzer.sefaz_autorizadas), 'notes/s')
+
+    if excel:
+        with tempfile.TemporaryDirectory() as directory:
+            _, stages['generate_detailed_excel'] = measure(
+                lambda: analyzer.generate_detailed_excel(os.path.join(directory, 'bench.xlsx')),
+                len(analyzer.processed_data), 'rows/s')
+
+    return {
+        'notes': notes,
+        'xml_files': manifest['xml_files'],
+        'products': len(analyzer.processed_data),
+        'xmls_nao_encontrados': len(analyzer.xmls_nao_encontrados),
+        'counters': dict(analyzer.diagnostics.counters),
+        'stages': stages,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Linhas de texto com a razão de tempo (atual / anterior) por etapa"""
+    anteriores = {r['notes']: r['stages'] for r in baseline['results']}
+    linhas = []
+    for result in results['results']:
+        for stage, atual in result['stages'].items():
+            anterior = anteriores.get(result['notes'], {}).get(stage)
+            if anterior and anterior['seconds']:
+                razao = atual['seconds'] / anterior['seconds']
+                linhas.append(f"{result['notes']:>9} {stage:<24} {anterior['seconds']:>9.3f}s "
+                              f"-> {atual['seconds']:>9.3f}s  x{razao:.2f}")
+    return linhas
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do NFeAnalyzer")
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help="Quantidades de notas (ex.: 1000 10000 1000000)")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'analisador-nfe-bench'),
+                        help="Pasta dos dados gerados (reaproveitados entre execuções)")
+    parser.add_argument('--output', default='bench_results.json', help="Arquivo JSON de resultados")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="Processos na leitura dos XMLs")
+    parser.add_argument('--no-excel', action='store_true', help="Não medir a geração do Excel")
+    parser.add_argument('--compare', help="JSON de uma execução anterior para comparar")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'workers': args.workers,
+        'seed': args.seed,
+        'results': [],
+    }
+
+    for notes in args.sizes:
+        print(f"{notes} notas...", file=sys.stderr)
+        result = run_size(notes, args.data_dir, args.seed, args.workers, not args.no_excel)
+        results['results'].append(result)
+        for stage, metrics in result['stages'].items():
+            pico = metrics['peak_rss_mb'] if metrics['peak_rss_mb'] is not None else metrics['tracemalloc_peak_mb']
+            print(f"  {stage:<24} {metrics['seconds']:>9.3f}s {metrics['throughput'] or 0:>12,.0f} "
+                  f"{metrics['unit']:<8} pico {pico or 0:>8.1f} MB", file=sys.stderr)
+
+    # Pico do processo todo, incluindo os processos de leitura dos XMLs
+    results['max_rss_mb'] = max_rss('RUSAGE_SELF')
+    results['max_rss_children_mb'] = max_rss('RUSAGE_CHILDREN')
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            for linha in compare(results, json.load(f)):
+                print(linha)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
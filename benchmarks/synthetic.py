@@ -0,0 +1,196 @@
+# synthetic.py - Gerador determinístico de dados de teste (XMLs, CSV SEFAZ, base NCM)
+#
+# Mesma semente e mesmo tamanho geram sempre os mesmos arquivos, então os
+# tempos de commits diferentes são comparáveis.
+import json
+import os
+import random
+import zipfile
+
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+
+# Versão do formato gerado; muda quando o gerador muda
+GENERATOR_VERSION = 1
+
+UNIDADES = ['UN', 'CX', 'KG', 'LT', 'PC', 'FD']
+CFOPS = ['5102', '5405', '6102', '5101', '6108']
+PALAVRAS = ['Refrigerante', 'Shampoo', 'Óleo', 'Sabão', 'Biscoito', 'Água', 'Cerveja',
+            'Detergente', 'Creme', 'Café', 'Açúcar', 'Pneu', 'Filtro', 'Lâmpada', 'Cabo']
+
+
+def chave_dv(base):
+    """Dígito verificador (módulo 11) dos 43 primeiros dígitos da chave"""
+    pesos = [2, 3, 4, 5, 6, 7, 8, 9]
+    soma = sum(int(d) * pesos[i % 8] for i, d in enumerate(reversed(base)))
+    resto = soma % 11
+    return '0' if resto < 2 else str(11 - resto)
+
+
+class SyntheticData:
+    """Gera notas com emitentes, NCMs e quantidade de itens variados
+
+    A nota i é sempre a mesma para a mesma semente, independente do total.
+    """
+
+    def __init__(self, seed=0, emitentes=50, ncms=2000):
+        rng = random.Random(seed)
+        self.seed = seed
+        self.cnpjs = [f"{rng.randrange(10**7, 10**8)}0001{rng.randrange(10, 100)}" for _ in range(emitentes)]
+        self.ncms = [f"{rng.randrange(1, 97):02d}{rng.randrange(0, 10**6):06d}" for _ in range(ncms)]
+
+    def chave(self, i):
+        rng = random.Random(f"{self.seed}-chave-{i}")
+        cnpj = self.cnpjs[rng.randrange(len(self.cnpjs))]
+        base = (f"{rng.choice(['35', '33', '31', '41'])}{rng.randrange(20, 25):02d}{rng.randrange(1, 13):02d}"
+                f"{cnpj}55{rng.randrange(1, 10):03d}{i % 10**9:09d}1{rng.randrange(10**8):08d}")
+        return base + chave_dv(base)
+
+    def produtos(self, i):
+        rng = random.Random(f"{self.seed}-produtos-{i}")
+        # Maioria com poucos itens, algumas notas grandes
+        itens = min(1 + int(rng.expovariate(1 / 4)), 80)
+        produtos = []
+        for n in range(itens):
+            quantidade = rng.randrange(1, 50)
+            valor_unitario = round(rng.uniform(0.5, 500), 2)
+            produtos.append({
+                'codigo': f"{rng.randrange(10**6):06d}",
+                'descricao': f"{rng.choice(PALAVRAS)} {rng.choice(PALAVRAS)} {n + 1}",
+                # ~3% dos itens com NCM fora da base
+                'ncm': rng.choice(self.ncms) if rng.random() > 0.03 else f"{rng.randrange(10**8):08d}",
+                'cfop': rng.choice(CFOPS),
+                'unidade': rng.choice(UNIDADES),
+                'quantidade': quantidade,
+                'valor_unitario': valor_unitario,
+                'valor': round(quantidade * valor_unitario, 2),
+            })
+        return produtos
+
+    def nfe_xml(self, i):
+        """XML nfeProc completo (com namespace e protocolo) da nota i"""
+        chave = self.chave(i)
+        produtos = self.produtos(i)
+        dets = ''.join(
+            f'<det nItem="{n}"><prod><cProd>{p["codigo"]}</cProd><cEAN>SEM GTIN</cEAN>'
+            f'<xProd>{p["descricao"]}</xProd><NCM>{p["ncm"]}</NCM><CFOP>{p["cfop"]}</CFOP>'
+            f'<uCom>{p["unidade"]}</uCom><qCom>{p["quantidade"]:.4f}</qCom>'
+            f'<vUnCom>{p["valor_unitario"]:.10f}</vUnCom><vProd>{p["valor"]:.2f}</vProd>'
+            f'<cEANTrib>SEM GTIN</cEANTrib><uTrib>{p["unidade"]}</uTrib><qTrib>{p["quantidade"]:.4f}</qTrib>'
+            f'<vUnTrib>{p["valor_unitario"]:.10f}</vUnTrib><indTot>1</indTot></prod>'
+            f'<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST></ICMS00></ICMS>'
+            f'<PIS><PISAliq><CST>01</CST><vBC>{p["valor"]:.2f}</vBC></PISAliq></PIS></imposto></det>'
+            for n, p in enumerate(produtos, start=1))
+        total = sum(p['valor'] for p in produtos)
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NFE_NS}" versao="4.00">'
+            f'<NFe xmlns="{NFE_NS}"><infNFe Id="NFe{chave}" versao="4.00">'
+            f'<ide><cUF>{chave[:2]}</cUF><mod>55</mod><serie>{int(chave[22:25])}</serie>'
+            f'<nNF>{int(chave[25:34])}</nNF><tpNF>1</tpNF></ide>'
+            f'<emit><CNPJ>{chave[6:20]}</CNPJ><xNome>Emitente {chave[6:14]}</xNome></emit>'
+            f'<dest><CNPJ>00000000000191</CNPJ><xNome>Destinatario</xNome></dest>'
+            f'{dets}<total><ICMSTot><vProd>{total:.2f}</vProd><vNF>{total:.2f}</vNF></ICMSTot></total>'
+            f'</infNFe></NFe><protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe>'
+            f'<cStat>100</cStat></infProt></protNFe></nfeProc>'
+        ).encode('utf-8')
+
+    def situacao(self, i):
+        """(situação, tipo de operação) da nota i na SEFAZ"""
+        sorteio = random.Random(f"{self.seed}-situacao-{i}").random()
+        if sorteio < 0.85:
+            return 'Autorizada', 'Saída'
+        if sorteio < 0.92:
+            return 'Autorizada', 'Entrada'
+        if sorteio < 0.97:
+            return 'Cancelada', 'Saída'
+        return 'Denegada', 'Saída'
+
+    def tem_xml(self, i):
+        """~95% das notas da SEFAZ têm XML"""
+        return random.Random(f"{self.seed}-xml-{i}").random() < 0.95
+
+
+def _valor_br(valor):
+    return 'R$ ' + f"{valor:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def write_sefaz_csv(data, path, notes):
+    """CSV no layout do relatório da SEFAZ (separador ';', valores em R$)"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('Chave de Acesso;Situação;Tipo Operacao;Valor Total;Emitente;Data Emissão\n')
+        for i in range(notes):
+            chave = data.chave(i)
+            situacao, tipo = data.situacao(i)
+            valor = sum(p['valor'] for p in data.produtos(i))
+            f.write(f"{chave};{situacao};{tipo};{_valor_br(valor)};{chave[6:20]};"
+                    f"20{chave[2:4]}-{chave[4:6]}-01\n")
+    return notes
+
+
+def write_ncm_sheet(data, path):
+    """Planilha NCM com título, cabeçalho e ~80% dos NCMs usados nas notas
+
+    Parte dos NCMs é gravada como número, como nas planilhas da TIPI.
+    """
+    import xlsxwriter
+
+    rng = random.Random(f"{data.seed}-ncm")
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    sheet = workbook.add_worksheet('NCM')
+    sheet.write_row(0, 0, ['Tabela de NCMs - PIS/COFINS'])
+    sheet.write_row(1, 0, ['NCM', 'Descrição', 'CEST', 'Vigência', 'Monofásico PIS/COFINS'])
+    row = 2
+    for ncm in data.ncms:
+        if rng.random() < 0.8:
+            # Texto com pontos, texto puro ou célula numérica (perde o zero à esquerda)
+            formato = rng.random()
+            if formato < 1 / 3:
+                ncm_cell = f"{ncm[:4]}.{ncm[4:6]}.{ncm[6:]}"
+            elif formato < 2 / 3:
+                ncm_cell = ncm
+            else:
+                ncm_cell = int(ncm)
+            sheet.write_row(row, 0, [ncm_cell, 'Produto', '', '2024',
+                                     'Monofásico' if rng.random() < 0.4 else 'Tributado'])
+            row += 1
+    workbook.close()
+    return row - 2
+
+
+def write_xml_zip(data, path, notes):
+    """ZIP com os XMLs das notas que têm XML, mais ~1% de notas fora da SEFAZ"""
+    count = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for i in range(notes + notes // 100):
+            if i < notes and not data.tem_xml(i):
+                continue
+            zf.writestr(f"xmls/{data.chave(i)}-nfe.xml", data.nfe_xml(i))
+            count += 1
+    return count
+
+
+def generate_dataset(directory, notes, seed=0):
+    """Gera (ou reaproveita) ncm.xlsx, sefaz.csv e xmls.zip em directory
+
+    Devolve o manifesto com os caminhos e as quantidades geradas.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, 'manifest.json')
+    params = {'notes': notes, 'seed': seed, 'version': GENERATOR_VERSION}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('params') == params:
+            return manifest
+
+    data = SyntheticData(seed)
+    paths = {name: os.path.join(directory, name) for name in ('ncm.xlsx', 'sefaz.csv', 'xmls.zip')}
+    manifest = {
+        'params': params,
+        'paths': paths,
+        'ncm_rows': write_ncm_sheet(data, paths['ncm.xlsx']),
+        'sefaz_rows': write_sefaz_csv(data, paths['sefaz.csv'], notes),
+        'xml_files': write_xml_zip(data, paths['xmls.zip'], notes),
+    }
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
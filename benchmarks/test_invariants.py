@@ -0,0 +1,213 @@
+# test_invariants.py - Garantias das otimizações sobre os dados sintéticos do benchmark
+#
+# Na raiz do projeto:
+#   python -m pytest benchmarks
+#
+# Cobre três equivalências: o parser incremental contra a leitura original
+# (ElementTree), a análise incremental contra uma análise completa do mesmo
+# estado final e a análise com os produtos em disco (orçamento de memória)
+# contra a análise em memória.
+import io
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import NFE_NS, SyntheticData, generate_dataset
+from nfe_analyzer import NFeAnalyzer
+from nfe_cache import NoteCache
+from nfe_ncmbase import NCMRegistry
+from nfe_parallel import parse_many
+from nfe_parser import parse_nfe
+from nfe_sefaz import CANCELADAS
+
+NOTES = 300
+
+
+def reference_parse(xml_content):
+    """Leitura original (ElementTree, antes do parser incremental): (chave, produtos)"""
+    root = ET.fromstring(xml_content.decode('utf-8', errors='ignore'))
+
+    def local(tag):
+        return tag.split('}')[-1]
+
+    def text(parent, name):
+        for elem in parent.iter():
+            if local(elem.tag) == name:
+                return elem.text.strip() if elem.text else ''
+        return ''
+
+    def number(parent, name):
+        try:
+            return float(text(parent, name) or 0)
+        except ValueError:
+            return 0.0
+
+    chave = None
+    for elem in root.iter():
+        if local(elem.tag) == 'infNFe':
+            id_attr = elem.get('Id', '')
+            if id_attr.startswith('NFe') or len(id_attr) == 44:
+                chave = ''.join(c for c in id_attr if c.isdigit())
+                break
+    if chave is None:
+        for elem in root.iter():
+            if local(elem.tag) == 'chNFe':
+                chave = ''.join(c for c in (elem.text or '') if c.isdigit())
+                break
+
+    produtos = []
+    for det in root.iter():
+        if local(det.tag) != 'det':
+            continue
+        prod = next((elem for elem in det.iter() if local(elem.tag) == 'prod'), None)
+        if prod is None:
+            continue
+        ncm = text(prod, 'NCM')
+        valor = number(prod, 'vProd')
+        if ncm and valor > 0:
+            produtos.append({
+                'ncm': ncm,
+                'descricao': text(prod, 'xProd') or 'Produto sem descrição',
+                'quantidade': number(prod, 'qCom'),
+                'valor_unitario': number(prod, 'vUnCom'),
+                'valor_produto_xml': valor,
+                'unidade': text(prod, 'uCom') or 'UN',
+                'cfop': text(prod, 'CFOP'),
+            })
+    return chave, produtos
+
+
+def edge_documents():
+    """XMLs fora do padrão do gerador: sem namespace, campos ausentes, só chNFe"""
+    nfe = SyntheticData(seed=1).nfe_xml(7)
+    return [
+        nfe.replace(f' xmlns="{NFE_NS}"'.encode(), b''),
+        nfe.replace(b'<xProd>', b'<xProd> ').replace(b'<uCom>UN</uCom>', b'<uCom></uCom>'),
+        b'<NFe><infNFe Id="NFe35-2401.123"><det nItem="1"><prod><NCM>22021000</NCM><vProd>0</vProd>'
+        b'</prod></det><det nItem="2"><prod><NCM>22021000</NCM><qCom>x</qCom><vProd>10.5</vProd>'
+        b'</prod></det><det nItem="3"><prod><xProd>Sem NCM</xProd><vProd>3</vProd></prod></det>'
+        b'</infNFe></NFe>',
+        b'<nfeProc><NFe><infNFe versao="4.00"/></NFe><protNFe><infProt><chNFe> 3524 0100 </chNFe>'
+        b'</infProt></protNFe></nfeProc>',
+    ]
+
+
+@pytest.fixture(scope='module')
+def dataset(tmp_path_factory):
+    manifest = generate_dataset(str(tmp_path_factory.mktemp('dados')), NOTES)
+    with zipfile.ZipFile(manifest['paths']['xmls.zip']) as zf:
+        xmls = [zf.read(name) for name in zf.namelist()]
+    return manifest['paths'], xmls
+
+
+def load(paths, xmls, memory_budget=None, sefaz_changes=()):
+    """NFeAnalyzer com NCM, SEFAZ e os XMLs carregados (ainda sem análise)"""
+    analyzer = NFeAnalyzer(workers=1, ncm_registry=NCMRegistry(), memory_budget=memory_budget)
+    assert analyzer.load_ncm_database(paths['ncm.xlsx'])[0]
+    assert analyzer.load_sefaz_database(paths['sefaz.csv'])[0]
+    for change in sefaz_changes:
+        change(analyzer)
+    analyzer.process_xml_files(io.BytesIO(content) for content in xmls)
+    return analyzer
+
+
+def results(analyzer):
+    """Produtos, XMLs não encontrados e conciliação, comparáveis entre análises"""
+    frame = analyzer.processed_data.to_dataframe()
+    # A ordem das categorias depende da ordem de chegada das notas
+    frame = frame.astype({column: str for column in frame.select_dtypes('category').columns})
+    nao_encontrados = [nota['chave'] for nota in analyzer.xmls_nao_encontrados]
+    return frame, nao_encontrados, analyzer.reconcile().summary()
+
+
+def assert_same_results(esperado, obtido):
+    pd.testing.assert_frame_equal(esperado[0], obtido[0])
+    assert esperado[1] == obtido[1]
+    pd.testing.assert_frame_equal(esperado[2], obtido[2])
+
+
+def test_parser_matches_reference():
+    data = SyntheticData(seed=0)
+    documents = [data.nfe_xml(i) for i in range(200)] + edge_documents()
+    for document in documents:
+        assert parse_nfe(document) == reference_parse(document)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parse_many_matches_serial(workers):
+    data = SyntheticData(seed=0)
+    documents = [data.nfe_xml(i) for i in range(250)] + [b'<quebrado']
+    esperado = [(document, parse_nfe(document)) for document in documents[:-1]] + [(b'<quebrado', (None, []))]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = NoteCache(f"{directory}/notas.sqlite")
+        for _ in range(2):
+            # Segunda volta: tudo vem do NoteCache
+            assert list(parse_many(documents, workers, min_parallel=100, cache=cache)) == esperado
+
+
+@pytest.mark.parametrize('memory_budget', [None, 1])
+def test_incremental_matches_full_analysis(dataset, memory_budget):
+    paths, xmls = dataset
+    metade = len(xmls) // 2
+    analyzer = load(paths, xmls[:metade], memory_budget)
+    analyzer.process_analysis()
+    analyzer.process_xml_files(io.BytesIO(content) for content in xmls[metade:])
+    analyzer.process_analysis()
+
+    # Os mesmos arquivos de novo não alteram nenhuma nota
+    analyzer.process_zip_files([io.BytesIO(_zip(xmls))])
+    analyzer.process_analysis()
+    assert analyzer.last_changes['alteradas'] == 0
+
+    chaves = list(analyzer.sefaz_autorizadas)
+    cancelada, valor_alterado, sem_xml = chaves[3], chaves[5], chaves[8]
+
+    def cancelar(target):
+        dados = dict(target.sefaz_autorizadas[cancelada], situacao='Cancelada')
+        target.add_notas_sefaz({CANCELADAS: {cancelada: dados}})
+
+    def alterar_valor(target):
+        target.sefaz_autorizadas[valor_alterado] = dict(target.sefaz_autorizadas[valor_alterado], valor=123.45)
+
+    # XML trocado (mesma chave, outro conteúdo) e XML removido
+    trocado = next(i for i, content in enumerate(xmls) if chaves[1].encode() in content)
+    final = list(xmls)
+    final[trocado] = xmls[trocado].replace(b'<xProd>', b'<xProd>Alterado ')
+    final = [content for content in final if sem_xml.encode() not in content]
+
+    cancelar(analyzer)
+    alterar_valor(analyzer)
+    analyzer.process_xml_files([io.BytesIO(final[trocado])])
+    analyzer.forget_xml(sem_xml)
+    analyzer.process_analysis()
+    assert analyzer.last_changes['removidas'] == 1
+    assert analyzer.last_changes['alteradas'] == 3
+
+    completo = load(paths, final, memory_budget, sefaz_changes=(cancelar, alterar_valor))
+    completo.process_analysis()
+    assert_same_results(results(completo), results(analyzer))
+
+
+def test_spill_matches_in_memory(dataset):
+    paths, xmls = dataset
+    memoria = load(paths, xmls)
+    memoria.process_analysis()
+    disco = load(paths, xmls, memory_budget=1)
+    disco.process_analysis()
+
+    assert not memoria.low_memory and disco.low_memory
+    assert disco.processed_data.spilled and not disco.xmls_produtos
+    assert_same_results(results(memoria), results(disco))
+    for dimensao, frame in memoria.summarize().breakdowns.items():
+        pd.testing.assert_frame_equal(frame, disco.summarize().breakdowns[dimensao])
+
+
+def _zip(xmls):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for i, content in enumerate(xmls):
+            zf.writestr(f"{i}.xml", content)
+    return buffer.getvalue()
@@ -0,0 +1,200 @@
+# ncm_index.py - Índice de classificação tributária por NCM
+import numpy as np
+import pandas as pd
+
+INDEFINIDO = 'Indefinido'
+MONOFASICO = 'Monofásico'
+TRIBUTADO = 'Tributado'
+
+# Tamanhos de prefixo aceitos na base (capítulo, posição, subposição)
+PREFIX_LENGTHS = (6, 4, 2)
+
+
+def normalize_ncm(ncm):
+    """NCM de produto com 8 dígitos (mesma limpeza do classificador antigo)"""
+    return str(ncm).replace('.', '').replace('-', '').strip().zfill(8)
+
+
+def normalize_ncm_key(value):
+    """Normaliza um NCM da base, mantendo capítulos/posições como prefixo
+
+    Valores numéricos do Excel perdem o zero à esquerda (0101 -> 101), então
+    tamanhos ímpares são completados até o próximo tamanho par. Códigos com
+    2, 4 ou 6 dígitos cobrem todo o capítulo/posição/subposição.
+    """
+    if isinstance(value, (int, float)):
+        digits = str(int(value))
+    else:
+        digits = str(value).replace('.', '').replace('-', '').strip()
+    if not digits.isdigit() or len(digits) >= 8:
+        return digits.zfill(8)
+    if len(digits) % 2:
+        digits = digits.zfill(len(digits) + 1)
+    return digits
+
+
+def classification_label(classificacao):
+    """Converte o texto da base em Monofásico/Tributado (ou o próprio texto)"""
+    lower = classificacao.lower()
+    if 'monofasico' in lower or 'monofásico' in lower:
+        return MONOFASICO
+    elif 'tributado' in lower:
+        return TRIBUTADO
+    return classificacao
+
+
+class NCMIndex:
+    """Índice pré-calculado NCM -> código de categoria
+
+    As classificações viram códigos inteiros (0 = Indefinido). A busca tenta
+    o NCM completo e depois os prefixos de 6, 4 e 2 dígitos, e o resultado
+    por texto de NCM é memorizado, então cada NCM distinto é normalizado
+    uma única vez.
+    """
+
+    def __init__(self, ncm_database=None):
+        self.labels = [INDEFINIDO, MONOFASICO, TRIBUTADO]
+        self._label_codes = {label: code for code, label in enumerate(self.labels)}
+        self._exact = {}
+        self._prefixes = {length: {} for length in PREFIX_LENGTHS}
+        self._memo = {}
+        if ncm_database:
+            for ncm, classificacao in ncm_database.items():
+                self.add(ncm, classificacao)
+
+    def __len__(self):
+        return len(self._exact) + sum(len(p) for p in self._prefixes.values())
+
+    def add(self, ncm_key, classificacao):
+        """Registra um NCM já normalizado por normalize_ncm_key"""
+        label = classification_label(classificacao)
+        code = self._label_codes.get(label)
+        if code is None:
+            code = self._label_codes[label] = len(self.labels)
+            self.labels.append(label)
+
+        if len(ncm_key) in self._prefixes:
+            self._prefixes[len(ncm_key)][ncm_key] = code
+        else:
+            self._exact[ncm_key] = code
+        self._memo.clear()
+
+    def code(self, ncm):
+        """Código da categoria do NCM de um produto (0 se não encontrado)"""
+        code = self._memo.get(ncm)
+        if code is None:
+            code = self._lookup(ncm)
+            self._memo[ncm] = code
+        return code
+
+    def _lookup(self, ncm):
+        if not ncm:
+            return 0
+        clean_ncm = normalize_ncm(ncm)
+        code = self._exact.get(clean_ncm)
+        if code is not None:
+            return code
+        for length in PREFIX_LENGTHS:
+            code = self._prefixes[length].get(clean_ncm[:length])
+            if code is not None:
+                return code
+        return 0
+
+    def classify(self, ncm):
+        """Classificação do NCM (Monofásico, Tributado, Indefinido, ...)"""
+        code = self._memo.get(ncm)
+        if code is None:
+            code = self.code(ncm)
+        return self.labels[code]
+
+
+def excel_engine():
+    """Usa o calamine (bem mais rápido) quando pandas e o pacote suportam"""
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return None
+    versao = tuple(int(p) for p in pd.__version__.split('.')[:2] if p.isdigit())
+    return 'calamine' if versao >= (2, 2) else None
+
+
+def _find_columns(header):
+    """Posições das colunas de NCM e de classificação no cabeçalho"""
+    ncm_col = None
+    class_col = None
+
+    for pos, col in enumerate(header):
+        if 'NCM' in str(col).upper():
+            ncm_col = pos
+            break
+
+    for pos, col in enumerate(header):
+        if any(term in str(col).upper() for term in ['MONOFASICO', 'MONOFÁSICO', 'PIS', 'COFINS']):
+            class_col = pos
+            break
+
+    return ncm_col, class_col
+
+
+def normalize_ncm_keys(values):
+    """Versão vetorizada de normalize_ncm_key para uma Series inteira
+
+    Aceita colunas de texto, numéricas (células de número do Excel) ou
+    mistas: o tipo de cada célula decide o tratamento, como no escalar.
+    """
+    values = values.astype(object)
+    is_number = values.map(lambda value: isinstance(value, (int, float, np.integer, np.floating)))
+
+    keys = pd.Series('', index=values.index, dtype=object)
+    text = values[~is_number].astype(str)
+    keys[text.index] = text.str.replace('.', '', regex=False).str.replace('-', '', regex=False).str.strip()
+    numeric = pd.to_numeric(values[is_number], errors='coerce').astype(np.float64)
+    numeric = numeric[np.isfinite(numeric)]
+    keys[numeric.index] = numeric.astype(np.int64).astype(str)
+    keys = keys[~is_number | keys.index.isin(numeric.index)]
+
+    length = keys.str.len()
+    short_digits = keys.str.isdigit() & (length < 8)
+    odd = short_digits & (length % 2 == 1)
+    keys[odd] = '0' + keys[odd]
+    keys[~short_digits] = keys[~short_digits].str.zfill(8)
+    return keys
+
+
+def read_ncm_excel(excel_file, usecols=None):
+    """Lê a planilha NCM de uma vez e devolve (NCMs, classificações)
+
+    O arquivo é lido uma única vez, sem cabeçalho: a linha de cabeçalho (1,
+    ou 0 se sobrarem menos de 10 linhas) é escolhida já em memória. Com
+    usecols (ex.: 'A,E' ou [0, 4]) apenas essas colunas são lidas.
+    """
+    raw = pd.read_excel(excel_file, sheet_name=0, header=None, usecols=usecols,
+                        engine=excel_engine())
+    header_row = 1 if len(raw) - 2 >= 10 else 0
+    header = raw.iloc[header_row] if len(raw) > header_row else []
+    data = raw.iloc[header_row + 1:]
+
+    ncm_col, class_col = _find_columns(header)
+    if ncm_col is None or class_col is None:
+        # Posições padrão da planilha (ou as duas colunas escolhidas)
+        ncm_col, class_col = (0, 1) if usecols is not None and raw.shape[1] == 2 else (0, 4)
+
+    if raw.shape[1] <= max(ncm_col, class_col):
+        return pd.Series(dtype=object), pd.Series(dtype=object)
+
+    ncm_values = data.iloc[:, ncm_col]
+    class_values = data.iloc[:, class_col]
+    valid = ncm_values.notna() & class_values.notna()
+
+    keys = normalize_ncm_keys(ncm_values[valid])
+    classificacoes = class_values[keys.index].astype(str).str.strip()
+    return keys, classificacoes
+
+
+def count_labels(classificacoes):
+    """(monofásicos, tributados) entre as classificações lidas"""
+    lower = classificacoes.str.lower()
+    monofasico = (lower.str.contains('monofasico', regex=False)
+                  | lower.str.contains('monofásico', regex=False))
+    tributado = ~monofasico & lower.str.contains('tributado', regex=False)
+    return int(monofasico.sum()), int(tributado.sum())
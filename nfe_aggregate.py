@@ -0,0 +1,113 @@
+# nfe_aggregate.py - Totais e detalhamentos dos produtos processados
+import numpy as np
+import pandas as pd
+
+from ncm_index import INDEFINIDO, MONOFASICO, TRIBUTADO
+from nfe_parser import chave_ano_mes, chave_cnpj
+
+# Dimensões de detalhamento: nome -> título da coluna
+DIMENSIONS = {
+    'classificacao': 'Classificação',
+    'ncm': 'NCM',
+    'cfop': 'CFOP',
+    'cnpj': 'CNPJ Emitente',
+    'mes': 'Mês',
+}
+
+# Ordem fixa das classificações conhecidas nas tabelas
+CLASSIFICATION_ORDER = [MONOFASICO, TRIBUTADO, INDEFINIDO]
+
+
+def chave_codes(store, func):
+    """(código do grupo por chave, valores do grupo) aplicando func às chaves
+
+    Ex.: chave_codes(store, chave_cnpj) agrupa as notas por emitente.
+    """
+    groups = {}
+    codes = np.array([groups.setdefault(func(chave), len(groups))
+                      for chave in store.categorical['chave_nfe'].categories], dtype=np.int32)
+    return codes, list(groups)
+
+
+def _dimension_codes(store, dimension):
+    """(código por linha, valores) da dimensão"""
+    if dimension in ('classificacao', 'cfop'):
+        column = store.categorical[dimension]
+        return column.view(), list(column.categories)
+    if dimension == 'ncm':
+        return store.string_codes('ncm')
+    func = chave_cnpj if dimension == 'cnpj' else chave_ano_mes
+    group_of_chave, values = chave_codes(store, func)
+    return group_of_chave[store.categorical['chave_nfe'].view()], values
+
+
+class Aggregates:
+    """Totais gerais e detalhamento por dimensão, calculados de uma vez
+
+    breakdowns[dimensão] é um DataFrame com notas, itens, valor, o valor de
+    cada classificação e o percentual sobre o total, do maior para o menor
+    valor (a tabela de classificação segue a ordem Monofásico, Tributado,
+    Indefinido).
+    """
+
+    def __init__(self, store, value='valor_produto_proporcional', dimensions=DIMENSIONS):
+        values = store.numeric[value].view()
+        chave_rows = store.categorical['chave_nfe'].view()
+        n_chaves = len(store.categorical['chave_nfe'].categories)
+        class_codes, class_labels = _dimension_codes(store, 'classificacao')
+        n_classes = len(class_labels)
+
+        self.valor_total = float(values.sum())
+        self.itens = len(store)
+        self.notas = int(np.count_nonzero(np.bincount(chave_rows, minlength=n_chaves)))
+
+        counts = np.bincount(class_codes, minlength=n_classes)
+        present = [label for label in CLASSIFICATION_ORDER if label in class_labels]
+        present += [label for label in class_labels if label not in present]
+        self.class_columns = [label for label in present if counts[class_labels.index(label)]]
+        self._class_positions = [class_labels.index(label) for label in self.class_columns]
+
+        self.breakdowns = {}
+        for dimension in dimensions:
+            codes, keys = _dimension_codes(store, dimension)
+            self.breakdowns[dimension] = self._breakdown(
+                dimension, codes, keys, values, class_codes, n_classes, chave_rows, n_chaves)
+
+    def _breakdown(self, dimension, codes, keys, values, class_codes, n_classes, chave_rows, n_chaves):
+        n = len(keys)
+        codes = np.asarray(codes, dtype=np.int64)
+        itens = np.bincount(codes, minlength=n)
+        valor = np.bincount(codes, weights=values, minlength=n)
+        # Valor por (grupo, classificação) numa única contagem
+        por_classe = np.bincount(codes * n_classes + class_codes, weights=values,
+                                 minlength=n * n_classes).reshape(n, n_classes)
+        # Notas distintas por grupo: pares (grupo, chave) únicos
+        pares = np.unique(codes * n_chaves + chave_rows)
+        notas = np.bincount(pares // n_chaves, minlength=n) if n_chaves else np.zeros(n, dtype=np.int64)
+
+        frame = pd.DataFrame({
+            DIMENSIONS[dimension]: keys,
+            'Notas': notas,
+            'Itens': itens,
+            'Valor Total': valor,
+        })
+        for label, position in zip(self.class_columns, self._class_positions):
+            frame[f"Valor {label}"] = por_classe[:, position]
+        frame['Percentual'] = valor / self.valor_total * 100 if self.valor_total > 0 else 0.0
+        frame = frame[frame['Itens'] > 0]
+
+        if dimension == 'classificacao':
+            ordem = {label: i for i, label in enumerate(self.class_columns)}
+            frame = frame.sort_values(DIMENSIONS[dimension], key=lambda col: col.map(ordem))
+        elif dimension == 'mes':
+            frame = frame.sort_values(DIMENSIONS[dimension])
+        else:
+            frame = frame.sort_values('Valor Total', ascending=False, kind='stable')
+        return frame.reset_index(drop=True)
+
+    def totals(self, dimension='classificacao'):
+        """{valor: (itens, valor)} no formato de ProductStore.totals"""
+        frame = self.breakdowns[dimension]
+        return {key: (int(itens), float(valor)) for key, itens, valor
+                in zip(frame[DIMENSIONS[dimension]], frame['Itens'], frame['Valor Total'])}
+
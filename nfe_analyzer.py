@@ -0,0 +1,663 @@
+# nfe_analyzer.py - Núcleo da análise NFe x SEFAZ (sem dependência do Streamlit)
+import os
+import tempfile
+from itertools import count, islice
+from types import MappingProxyType
+
+import numpy as np
+
+from nfe_parser import parse_nfe, extract_chave
+from nfe_parallel import parse_many
+from nfe_archive import iter_zip_xmls
+from nfe_store import ProductStore
+from nfe_xmlstore import XMLStore
+from nfe_aggregate import Aggregates
+from nfe_reconcile import Reconciliation
+from nfe_explorer import ResultsIndex
+from nfe_diagnostics import Diagnostics
+from nfe_cache import FingerprintCache, fingerprint, file_fingerprint, MISSING, UPLOAD_CACHE_SIZE
+from ncm_index import NCMIndex
+from nfe_ncmbase import NCM_REGISTRY
+from nfe_export import (write_detailed_excel, write_table_sheet, write_parquet, write_csv_gz,
+                        write_reconciliation_csv, write_reconciliation_sheets)
+from nfe_sefaz import iter_sefaz_frames, CHUNK_THRESHOLD, AUTORIZADAS, CANCELADAS, DENEGADAS, ENTRADA
+
+
+# Planilhas de detalhamento do Excel: (dimensão, nome da planilha)
+SUMMARY_SHEETS = [
+    ('ncm', 'Por NCM'),
+    ('cfop', 'Por CFOP'),
+    ('cnpj', 'Por Emitente'),
+    ('mes', 'Por Mês'),
+]
+
+
+# Memória estimada por produto extraído dos XMLs (dicionário com os campos)
+PARSED_PRODUCT_BYTES = 650
+
+# Fração do orçamento a partir da qual os produtos processados vão para o disco
+SPILL_THRESHOLD = 0.8
+
+# Notas classificadas entre duas verificações do orçamento
+SPILL_CHECK_NOTES = 1000
+
+
+def default_memory_budget():
+    """Orçamento de memória em bytes (NFE_MEMORY_BUDGET_MB) ou None (sem limite)"""
+    value = os.environ.get('NFE_MEMORY_BUDGET_MB')
+    return int(float(value) * 1024 * 1024) if value else None
+
+
+class ProgressReporter:
+    """Recebe o andamento da análise; a implementação padrão não exibe nada"""
+    
+    def update(self, done, total, message=''):
+        pass
+    
+    def close(self):
+        pass
+
+
+class NFeAnalyzer:
+    def __init__(self, workers=None, upload_cache_size=UPLOAD_CACHE_SIZE, note_cache=None, diagnostics=None,
+                 ncm_registry=None, memory_budget=None):
+        self.workers = workers
+        # Sem orçamento, vale NFE_MEMORY_BUDGET_MB; sem nenhum dos dois, não há limite
+        self.memory_budget = memory_budget if memory_budget is not None else default_memory_budget()
+        self.diagnostics = diagnostics or Diagnostics()
+        self.upload_cache = FingerprintCache(upload_cache_size)
+        self.note_cache = note_cache
+        # Bases NCM compartilhadas pelo processo; a sessão guarda só as referências
+        self.ncm_registry = ncm_registry or NCM_REGISTRY
+        self.ncm_bases = []
+        self.ncm_database = {}
+        self.ncm_index = None
+        self._ncm_index_of = None
+        self.sefaz_autorizadas = {}
+        self.sefaz_canceladas = {}
+        self.sefaz_denegadas = {}
+        self.sefaz_entrada = {}
+        # XMLs originais ficam em disco; em memória só o índice por chave
+        self.xmls_database = XMLStore()
+        self.xmls_produtos = {}
+        self._produtos_count = 0
+        # Versão de cada XML registrado (fingerprint do conteúdo): só um XML trocado muda a versão
+        self._xml_versions = {}
+        self._xml_seq = count(1)
+        # Orçamento de memória atingido: produtos em disco e produtos dos XMLs refeitos quando preciso
+        self.low_memory = False
+        self.processed_data = ProductStore()
+        self.excluded_data = []
+        self.xmls_nao_encontrados = []
+        self.reset_analysis()
+        
+    def _load_cached(self, kind, file, loader, *args, stage=None):
+        """Reaproveita o resultado se o mesmo conteúdo já foi carregado (stage fica marcada como cache)"""
+        key = (kind, file_fingerprint(file))
+        result = self.upload_cache.get(key)
+        if result is None:
+            result = loader(file, *args)
+            if result[0]:
+                self.upload_cache.put(key, result)
+        elif stage is not None:
+            stage.cached = True
+        return result
+    
+    def load_ncm_database(self, excel_file, usecols=None):
+        """Carrega a base de dados de NCMs do arquivo Excel
+        
+        A planilha é lida uma vez por processo (NCMRegistry, pelo hash do
+        conteúdo); outras sessões com o mesmo arquivo reutilizam a base.
+        """
+        with self.diagnostics.stage('load_ncm_database', 'NCMs') as stage:
+            try:
+                base = self.ncm_registry.get(excel_file, usecols)
+            except Exception as e:
+                self.diagnostics.count('ncm_erro_leitura')
+                return False, str(e), 0, 0
+            # Mesma base já em uso pela sessão (reexecução da página): nada a registrar
+            stage.cached = any(base is atual for atual in self.ncm_bases)
+            self.use_ncm_base(base)
+            stage.items = len(base)
+        return True, len(self.ncm_database), base.count_monofasico, base.count_tributado
+    
+    def use_ncm_base(self, base):
+        """Passa a classificar pela base compartilhada (somada às já carregadas)"""
+        if any(base is atual for atual in self.ncm_bases):
+            return
+        self.ncm_bases.append(base)
+        if len(self.ncm_bases) == 1 and not self.ncm_database:
+            # Caso comum: nenhuma cópia, tabela e índice são os da base
+            self.ncm_database = base.table
+            self.ncm_index = base.index
+        else:
+            database = dict(self.ncm_database)
+            database.update(base.table)
+            self.ncm_database = database
+            self.ncm_index = NCMIndex(database)
+        self._ncm_index_of = self.ncm_database
+    
+    def load_sefaz_database(self, csv_file, chunk_threshold=CHUNK_THRESHOLD):
+        """Carrega e categoriza todas as notas da SEFAZ"""
+        with self.diagnostics.stage('load_sefaz_database', 'notas') as stage:
+            result = self._load_cached('sefaz', csv_file, self._load_sefaz_database, chunk_threshold,
+                                       stage=stage)
+            if result[0]:
+                stage.items = result[1] + result[3] + result[5]
+        return result
+    
+    def _load_sefaz_database(self, csv_file, chunk_threshold):
+        try:
+            try:
+                notas, contagens, valores = self._read_sefaz(csv_file, chunk_threshold)
+            except UnicodeDecodeError:
+                notas, contagens, valores = self._read_sefaz(csv_file, chunk_threshold, encoding='latin-1')
+            
+            self.add_notas_sefaz(notas)
+            
+            return (True, contagens[AUTORIZADAS], valores[AUTORIZADAS], contagens[CANCELADAS],
+                    valores[CANCELADAS], contagens[ENTRADA], valores[ENTRADA])
+            
+        except Exception as e:
+            self.diagnostics.count('sefaz_erro_leitura')
+            return False, str(e), 0, 0, 0, 0
+    
+    def _read_sefaz(self, csv_file, chunk_threshold, encoding=None):
+        """Lê o CSV em blocos vetorizados e agrupa as notas por categoria"""
+        notas = {categoria: {} for categoria in (AUTORIZADAS, CANCELADAS, DENEGADAS, ENTRADA)}
+        contagens = dict.fromkeys(notas, 0)
+        valores = dict.fromkeys(notas, 0)
+        
+        for frame in iter_sefaz_frames(csv_file, chunk_threshold, encoding=encoding):
+            for categoria, grupo in frame.groupby('categoria', sort=False):
+                colunas = [grupo[col].tolist() for col in ('chave', 'situacao', 'tipo_operacao', 'valor')]
+                notas[categoria].update(
+                    (chave, {'chave': chave, 'situacao': situacao, 'tipo_operacao': tipo_op, 'valor': valor})
+                    for chave, situacao, tipo_op, valor in zip(*colunas)
+                )
+                contagens[categoria] += len(grupo)
+                # Soma sequencial, igual à do carregamento linha a linha
+                valores[categoria] = sum(colunas[3], valores[categoria])
+        
+        return notas, contagens, valores
+    
+    def notas_sefaz(self):
+        """{categoria: {chave: dados}} de todas as notas carregadas da SEFAZ"""
+        return {AUTORIZADAS: self.sefaz_autorizadas, CANCELADAS: self.sefaz_canceladas,
+                DENEGADAS: self.sefaz_denegadas, ENTRADA: self.sefaz_entrada}
+    
+    def add_notas_sefaz(self, notas):
+        """Acrescenta notas já separadas por categoria (ex.: uma partição do lote)
+        
+        Cada chave fica em uma única categoria: uma nota que chega em outra
+        (ex.: autorizada que um CSV posterior traz cancelada) sai da anterior,
+        e a análise seguinte a trata como removida. Na mesma carga vale a
+        última categoria (cancelada/denegada/entrada sobre autorizada).
+        """
+        atuais = self.notas_sefaz()
+        for categoria in (AUTORIZADAS, CANCELADAS, DENEGADAS, ENTRADA):
+            novas = notas.get(categoria)
+            if not novas:
+                continue
+            for outra, existentes in atuais.items():
+                if outra == categoria or not existentes:
+                    continue
+                menor, maior = (existentes, novas) if len(existentes) < len(novas) else (novas, existentes)
+                for chave in [chave for chave in menor if chave in maior]:
+                    del existentes[chave]
+            atuais[categoria].update(novas)
+    
+    def process_xml_files(self, xml_files):
+        """Processa lista de arquivos XML"""
+        with self.diagnostics.stage('process_xml_files', 'XMLs') as stage:
+            xmls_em_cache = 0
+            lidos = 0
+            
+            def pendentes():
+                # Lidos um a um conforme a extração consome; o hash segue junto
+                nonlocal xmls_em_cache, lidos
+                for xml_file in xml_files:
+                    try:
+                        content = xml_file.read()
+                    except:
+                        self.diagnostics.count('xml_erro_leitura')
+                        continue
+                    
+                    # Arquivos já processados nesta sessão não são lidos de novo
+                    hash_ = fingerprint(content)
+                    chave = self.upload_cache.get(('xml', hash_), MISSING)
+                    if chave is MISSING or (chave and chave not in self.xmls_database):
+                        lidos += 1
+                        yield hash_, content
+                    elif chave:
+                        xmls_em_cache += 1
+            
+            processados = self.ingest_xml_contents(pendentes(), hashed=True)
+            stage.cached = not lidos
+            stage.items = xmls_em_cache + processados
+        return stage.items
+    
+    def process_zip_files(self, zip_files):
+        """Processa arquivos ZIP com XMLs (inclusive ZIPs dentro de ZIPs)"""
+        with self.diagnostics.stage('process_zip_files', 'XMLs') as stage:
+            stage.cached = True
+            for zip_file in zip_files:
+                key = ('zip', file_fingerprint(zip_file))
+                count = self.upload_cache.get(key)
+                if count is None:
+                    stage.cached = False
+                    count = self.ingest_xml_contents(
+                        ((fingerprint(content), content) for content in iter_zip_xmls(zip_file)), hashed=True)
+                    self.upload_cache.put(key, count)
+                stage.items += count
+        
+        return stage.items
+    
+    def ingest_xml_contents(self, contents, hashed=False):
+        """Extrai chave e produtos de cada XML e registra na base
+        
+        contents pode ser um gerador; com hashed, traz pares (hash, content).
+        """
+        xmls_processados = 0
+        
+        for item, (chave, produtos) in parse_many(contents, self.workers, cache=self.note_cache, hashed=hashed):
+            hash_, content = item if hashed else (fingerprint(item), item)
+            if chave and len(chave) == 44:
+                self.add_xml(chave, content, produtos, hash_)
+                xmls_processados += 1
+            else:
+                # XML inválido (mesmo após a releitura tolerante) ou sem chave
+                self.diagnostics.count('xml_sem_chave')
+                chave = None
+            self.upload_cache.put(('xml', hash_), chave)
+        
+        return xmls_processados
+    
+    def add_xml(self, chave, content, produtos, hash_=None):
+        """Registra um XML já extraído (sem produtos, a extração fica para a análise)
+        
+        hash_ é o fingerprint do conteúdo, se o chamador já o tem. O mesmo
+        XML enviado de novo não é gravado outra vez nem marca a nota como
+        alterada.
+        """
+        versao = hash_ or fingerprint(content)
+        if self._xml_versions.get(chave) != versao:
+            self.xmls_database[chave] = content
+            self._xml_versions[chave] = versao
+        self._set_produtos(chave, produtos)
+        self._check_memory()
+    
+    def add_xml_file(self, chave, produtos, path, hash_=None):
+        """Registra um XML já extraído que continua em disco (pasta monitorada)
+        
+        Sem hash_ (fingerprint do arquivo), a nota conta como alterada.
+        """
+        self.xmls_database.add_file(chave, path)
+        self._xml_versions[chave] = hash_ or next(self._xml_seq)
+        self._set_produtos(chave, produtos)
+        self._check_memory()
+    
+    def forget_xml(self, chave):
+        """Remove o XML da chave (ex.: arquivo apagado da pasta); a análise seguinte o trata como ausente"""
+        if chave in self.xmls_database:
+            del self.xmls_database[chave]
+        self._xml_versions.pop(chave, None)
+        self._set_produtos(chave, None)
+    
+    def _set_produtos(self, chave, produtos):
+        """Guarda (ou descarta, com produtos=None) os produtos extraídos do XML"""
+        anteriores = self.xmls_produtos.pop(chave, None)
+        if anteriores is not None:
+            self._produtos_count -= len(anteriores)
+        if produtos is not None and not self.low_memory:
+            self.xmls_produtos[chave] = produtos
+            self._produtos_count += len(produtos)
+    
+    def _extract_produtos(self, chave):
+        """Produtos do XML da chave: os guardados ou extraídos de novo (NoteCache ou o próprio XML)"""
+        produtos = self.xmls_produtos.get(chave)
+        if produtos is None and chave in self.xmls_database:
+            for _, (_, produtos) in parse_many([self.xmls_database[chave]], 1, cache=self.note_cache):
+                pass
+        return produtos
+    
+    def extract_chave_from_xml_content(self, xml_content):
+        """Extrai chave de conteúdo XML"""
+        try:
+            return extract_chave(xml_content)
+        except:
+            self.diagnostics.count('xml_erro_chave')
+            return None
+    
+    def _current_ncm_index(self, rebuild=False):
+        """NCMIndex da base atual; refeito se ncm_database foi trocado ou alterado diretamente"""
+        if rebuild or self.ncm_index is None or self._ncm_index_of is not self.ncm_database:
+            self.ncm_index = NCMIndex(self.ncm_database)
+            self._ncm_index_of = self.ncm_database
+        return self.ncm_index
+    
+    def classify_product(self, ncm):
+        """Classifica produto por NCM"""
+        return self._current_ncm_index().classify(ncm)
+    
+    def extract_products_from_xml(self, xml_content):
+        """Extrai produtos de XML"""
+        try:
+            chave, produtos = parse_nfe(xml_content)
+            return self.classify_products(produtos)
+        except:
+            self.diagnostics.count('xml_erro_produtos')
+            return []
+    
+    def classify_products(self, produtos):
+        """Monta os produtos classificados a partir dos campos extraídos do XML"""
+        classify = self._current_ncm_index().classify
+        return [{
+            'ncm': produto['ncm'],
+            'descricao': produto['descricao'],
+            'classificacao': classify(produto['ncm']),
+            'quantidade': produto['quantidade'],
+            'valor_unitario': produto['valor_unitario'],
+            'valor_produto_xml': produto['valor_produto_xml'],
+            'unidade': produto['unidade'],
+            'cfop': produto['cfop']
+        } for produto in produtos]
+    
+    def reset_analysis(self):
+        """Descarta os resultados por nota; a próxima análise refaz tudo"""
+        self.processed_data = ProductStore()
+        if self.low_memory:
+            self.processed_data.spill()
+        self.xmls_nao_encontrados = []
+        # chave -> (valor SEFAZ, situação, versão do XML ou None) da última análise
+        self.analysis_state = {}
+        self._nao_encontrados = {}
+        self._ncm_snapshot = None
+        self._aggregates = None
+        self._reconciliation = None
+        self._results_index = None
+        self.last_changes = {'novas': 0, 'alteradas': 0, 'removidas': 0, 'ncm_alterada': False}
+    
+    def memory_footprint(self):
+        """Estimativa em bytes dos dados da sessão em memória (produtos dos XMLs + produtos processados)"""
+        return self._parsed_bytes() + self.processed_data.memory_bytes
+    
+    def _parsed_bytes(self):
+        return PARSED_PRODUCT_BYTES * self._produtos_count
+    
+    def _check_memory(self, manter=()):
+        """Perto do orçamento, libera a memória das duas maiores estruturas da sessão
+        
+        Os produtos processados passam para o disco (ProductStore.spill) e os
+        produtos extraídos dos XMLs deixam de ficar em memória: são refeitos
+        quando preciso a partir do NoteCache ou do XML no XMLStore. manter
+        são as chaves cujos produtos ainda serão usados pela análise em curso.
+        """
+        if self.memory_budget is None or self.low_memory:
+            return
+        if self.memory_footprint() < SPILL_THRESHOLD * self.memory_budget:
+            return
+        with self.diagnostics.stage('memoria.spill', 'linhas') as stage:
+            self.low_memory = True
+            self.processed_data.spill()
+            manter = set(manter)
+            descartar = [chave for chave in self.xmls_produtos if chave not in manter]
+            self.diagnostics.count('produtos_xml_descartados',
+                                   sum(len(self.xmls_produtos[chave]) for chave in descartar))
+            for chave in descartar:
+                self._set_produtos(chave, None)
+            stage.items = len(self.processed_data)
+        self.diagnostics.count('produtos_em_disco')
+    
+    def _diff_analysis(self):
+        """(novas, alteradas, removidas) desde a última análise"""
+        novas = []
+        alteradas = []
+        for chave, dados_sefaz in self.sefaz_autorizadas.items():
+            versao = self._xml_versions.get(chave) if chave in self.xmls_database else None
+            anterior = self.analysis_state.get(chave)
+            if anterior is None:
+                novas.append(chave)
+            elif (anterior[2] != versao or anterior[0] != dados_sefaz['valor']
+                  or anterior[1] != dados_sefaz['situacao']):
+                alteradas.append(chave)
+        removidas = [chave for chave in self.analysis_state if chave not in self.sefaz_autorizadas]
+        return novas, alteradas, removidas
+    
+    def _drop_notes(self, chaves):
+        """Remove do processed_data os produtos das chaves informadas"""
+        store = self.processed_data
+        if not chaves or not store:
+            return
+        coluna = store.categorical['chave_nfe']
+        codes = [coluna.code_of(chave, create=False) for chave in chaves]
+        manter = ~np.isin(coluna.view(), codes)
+        if not manter.all():
+            self.processed_data = store.take(np.flatnonzero(manter))
+    
+    def _sort_by_sefaz(self):
+        """Reordena os produtos na ordem das notas da SEFAZ (igual à análise completa)"""
+        store = self.processed_data
+        posicao = {chave: i for i, chave in enumerate(self.sefaz_autorizadas)}
+        coluna = store.categorical['chave_nfe']
+        posicao_codigo = np.array([posicao.get(chave, -1) for chave in coluna.categories], dtype=np.int64)
+        linhas = posicao_codigo[coluna.view()]
+        if len(linhas) > 1 and (linhas[1:] < linhas[:-1]).any():
+            self.processed_data = store.take(np.argsort(linhas, kind='stable'))
+    
+    def process_analysis(self, progress=None, full=False):
+        """Processa análise baseada na SEFAZ
+        
+        A análise é incremental: só as notas novas, removidas ou alteradas
+        desde a última execução (outro valor/situação na SEFAZ ou outro XML)
+        são recalculadas, e uma base NCM diferente apenas reclassifica os
+        produtos já montados. O resultado é o mesmo da análise completa,
+        que pode ser forçada com full=True.
+        """
+        if full:
+            self.reset_analysis()
+        
+        progress = progress or ProgressReporter()
+        
+        with self.diagnostics.stage('process_analysis.diff', 'notas') as stage:
+            novas, alteradas, removidas = self._diff_analysis()
+            stage.items = len(self.sefaz_autorizadas)
+        
+        ncm_alterada = self.ncm_database is not self._ncm_snapshot and self.ncm_database != self._ncm_snapshot
+        self._current_ncm_index(rebuild=ncm_alterada and not isinstance(self.ncm_database, MappingProxyType))
+        if ncm_alterada:
+            # Bases compartilhadas são somente leitura: basta guardar a referência
+            self._ncm_snapshot = (self.ncm_database if isinstance(self.ncm_database, MappingProxyType)
+                                  else dict(self.ncm_database))
+            with self.diagnostics.stage('process_analysis.reclassificacao', 'linhas') as stage:
+                self.processed_data.relabel('classificacao', 'ncm', self.ncm_index.classify)
+                stage.items = len(self.processed_data)
+        
+        self.last_changes = {'novas': len(novas), 'alteradas': len(alteradas),
+                             'removidas': len(removidas), 'ncm_alterada': ncm_alterada}
+        
+        self._drop_notes(alteradas + removidas)
+        for chave in alteradas + removidas:
+            self.analysis_state.pop(chave, None)
+            self._nao_encontrados.pop(chave, None)
+        
+        recalcular = novas + alteradas
+        total_items = len(recalcular)
+        processed = 0
+        # XMLs sem produtos em memória (ainda não extraídos ou descartados pelo orçamento):
+        # extraídos em paralelo, lidos do disco conforme o laço consome
+        pendentes = [chave for chave in recalcular
+                     if chave in self.xmls_database and chave not in self.xmls_produtos]
+        extraidos = (produtos for _, (_, produtos) in parse_many(
+            (self.xmls_database[chave] for chave in pendentes), self.workers, cache=self.note_cache))
+        pendentes = set(pendentes)
+        
+        with self.diagnostics.stage('process_analysis.classificacao', 'notas') as stage:
+            for chave in recalcular:
+                if processed % SPILL_CHECK_NOTES == 0:
+                    self._check_memory(islice(recalcular, processed, None))
+                dados_sefaz = self.sefaz_autorizadas[chave]
+                if chave in self.xmls_database:
+                    produtos = next(extraidos) if chave in pendentes else self.xmls_produtos[chave]
+                    self.processed_data.append_note(chave, dados_sefaz['valor'], self.classify_products(produtos),
+                                                    'Autorizada + Saída')
+                    # Com o orçamento atingido, os produtos ficam só no store
+                    self._set_produtos(chave, None if self.low_memory else produtos)
+                    versao = self._xml_versions[chave]
+                else:
+                    versao = None
+                    self._nao_encontrados[chave] = {
+                        'chave': chave,
+                        'valor': dados_sefaz['valor'],
+                        'situacao': dados_sefaz['situacao'],
+                        'motivo': 'XML não encontrado'
+                    }
+                self.analysis_state[chave] = (dados_sefaz['valor'], dados_sefaz['situacao'], versao)
+                
+                processed += 1
+                progress.update(processed, total_items, f"Processando... {processed}/{total_items}")
+            stage.items = processed
+        
+        if alteradas or (novas and len(self.analysis_state) > len(novas)):
+            # Notas recalculadas entram no fim; volta à ordem da SEFAZ
+            self._sort_by_sefaz()
+        if recalcular or removidas:
+            self.xmls_nao_encontrados = [self._nao_encontrados[chave] for chave in self.sefaz_autorizadas
+                                         if chave in self._nao_encontrados]
+        
+        self._aggregates = None
+        self._reconciliation = None
+        self._results_index = None
+        progress.close()
+        
+        return len(self.processed_data), len(self.xmls_nao_encontrados)
+    
+    def summarize(self):
+        """Totais e detalhamentos (classificação, NCM, CFOP, emitente, mês) da última análise"""
+        if self._aggregates is None:
+            with self.diagnostics.stage('agregacao', 'linhas') as stage:
+                self._aggregates = Aggregates(self.processed_data)
+                stage.items = len(self.processed_data)
+        return self._aggregates
+    
+    def results_index(self):
+        """Índice para filtrar, ordenar e paginar os produtos da última análise"""
+        if self._results_index is None:
+            with self.diagnostics.stage('indice_resultados', 'linhas') as stage:
+                self._results_index = ResultsIndex(self.processed_data)
+                stage.items = len(self.processed_data)
+        return self._results_index
+    
+    def reconcile(self):
+        """Conciliação SEFAZ (todas as categorias) x XMLs carregados, calculada uma vez por análise"""
+        if self._reconciliation is None:
+            with self.diagnostics.stage('conciliacao', 'chaves') as stage:
+                self._reconciliation = Reconciliation(self.notas_sefaz(), self.xmls_database.keys(),
+                                                      self._xml_valor)
+                stage.items = len(self._reconciliation.chaves)
+        return self._reconciliation
+    
+    def _xml_valor(self, chave):
+        """Soma dos produtos do XML (para notas sem valor na SEFAZ)"""
+        return sum(produto['valor_produto_xml'] for produto in self._extract_produtos(chave) or ())
+    
+    def generate_detailed_excel(self, output=None):
+        """Gera Excel detalhado com formatação
+        
+        Sem output, devolve um arquivo temporário (já no início) em vez de
+        manter o Excel inteiro em memória; com output (caminho ou arquivo),
+        grava nele e o devolve.
+        """
+        if not self.processed_data:
+            return None
+        
+        target = output if output is not None else tempfile.TemporaryFile()
+        with self.diagnostics.stage('generate_detailed_excel', 'linhas') as stage:
+            write_detailed_excel(self.processed_data, target, self.add_summary_sheet)
+            stage.items = len(self.processed_data)
+        
+        if output is None:
+            target.seek(0)
+        return target
+    
+    def generate_export(self, fmt, output, partition_by=None):
+        """Exporta os produtos em 'parquet' ou 'csv' (gzip)
+        
+        Sem partition_by, output é o arquivo; com 'classificacao' ou 'cnpj'
+        (emitente), output é a pasta com um arquivo por partição. Devolve a
+        lista de arquivos gravados.
+        """
+        if not self.processed_data:
+            return []
+        
+        writer = {'parquet': write_parquet, 'csv': write_csv_gz}[fmt]
+        with self.diagnostics.stage(f'generate_export.{fmt}', 'linhas') as stage:
+            files = writer(self.processed_data, output, partition_by)
+            stage.items = len(self.processed_data)
+        return files
+    
+    def generate_reconciliation(self, directory, names=None):
+        """Grava as listas da conciliação (CSV gzip, uma por grupo) e devolve os arquivos"""
+        with self.diagnostics.stage('generate_reconciliation', 'notas') as stage:
+            reconciliation = self.reconcile()
+            files = write_reconciliation_csv(reconciliation, directory, names)
+            stage.items = sum(len(linhas) for linhas in reconciliation.buckets.values())
+        return files
+    
+    def generate_reports(self, base, formats=('xlsx',), partition_by=None, reconciliation=False):
+        """Grava os relatórios da análise com o prefixo de caminho base e devolve os arquivos
+        
+        formats: 'xlsx', 'parquet' e/ou 'csv'; com reconciliation, também as
+        listas da conciliação em base + '_conciliacao'.
+        """
+        outputs = []
+        if 'xlsx' in formats:
+            if self.generate_detailed_excel(base + '.xlsx') is not None:
+                outputs.append(base + '.xlsx')
+        for fmt, extension in (('parquet', '.parquet'), ('csv', '.csv.gz')):
+            if fmt in formats:
+                target = base + (f"_{fmt}" if partition_by else extension)
+                outputs.extend(self.generate_export(fmt, target, partition_by))
+        if reconciliation:
+            outputs.extend(self.generate_reconciliation(base + '_conciliacao'))
+        return outputs
+    
+    def add_summary_sheet(self, workbook):
+        """Adiciona planilha de resumo, os detalhamentos por NCM, CFOP, emitente e mês e a conciliação"""
+        rows = []
+        
+        resumo = self.summarize()
+        valor_total = resumo.valor_total
+        totais = resumo.totals('classificacao')
+        
+        for classificacao in ['Monofásico', 'Tributado', 'Indefinido']:
+            quantidade, valor = totais.get(classificacao, (0, 0.0))
+            if quantidade:
+                rows.append((classificacao, quantidade, valor,
+                             (valor / valor_total * 100) if valor_total > 0 else 0))
+        
+        rows.append(('TOTAL GERAL', resumo.itens, valor_total, 100.0))
+        
+        write_table_sheet(workbook, 'Resumo', ['Categoria', 'Quantidade', 'Valor Total', 'Percentual'], rows)
+        
+        for dimension, sheet_name in SUMMARY_SHEETS:
+            frame = resumo.breakdowns[dimension]
+            write_table_sheet(workbook, sheet_name, list(frame.columns), frame.itertuples(index=False, name=None))
+        
+        write_reconciliation_sheets(workbook, self.reconcile())
+    
+    def diagnostics_json(self):
+        """Etapas, contadores e uso dos caches em JSON"""
+        caches = {'upload': {'hits': self.upload_cache.hits, 'misses': self.upload_cache.misses,
+                             'entries': len(self.upload_cache)}}
+        if self.note_cache is not None:
+            caches['notas'] = {'hits': self.note_cache.hits, 'misses': self.note_cache.misses}
+        caches['ncm'] = self.ncm_registry.stats()
+        xmls = {'documentos': len(self.xmls_database), 'bytes_originais': self.xmls_database.raw_bytes,
+                'bytes_em_disco': self.xmls_database.disk_bytes,
+                'arquivos_ausentes': self.xmls_database.missing_files}
+        memoria = {'orcamento': self.memory_budget, 'estimativa': self.memory_footprint(),
+                   'orcamento_atingido': self.low_memory,
+                   'produtos_em_disco': self.processed_data.spilled,
+                   'bytes_produtos_em_disco': self.processed_data.disk_bytes}
+        return self.diagnostics.to_json({'caches': caches, 'xmls': xmls, 'memoria': memoria})
@@ -0,0 +1,58 @@
+# nfe_archive.py - Leitura de XMLs NFe dentro de arquivos ZIP (inclusive aninhados)
+import shutil
+import tempfile
+import zipfile
+import zlib
+
+# Profundidade máxima de ZIPs dentro de ZIPs
+MAX_NESTING = 5
+
+# Membros XML maiores que isso são ignorados (proteção contra ZIP bomb)
+MAX_XML_SIZE = 50 * 1024 * 1024
+
+# ZIPs internos compactados maiores que isso são descompactados para o disco
+NESTED_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def iter_zip_xmls(zip_file, depth=0):
+    """Gera o conteúdo (bytes) de cada XML do ZIP, um membro por vez
+
+    Nada é extraído para o disco: cada membro é lido direto do arquivo
+    compactado. ZIPs internos são percorridos recursivamente sem carregar
+    o membro inteiro: os armazenados sem compressão são lidos direto do
+    ZIP externo, os compactados passam por um arquivo temporário (em
+    memória até NESTED_SPOOL_SIZE); entradas que não são XML são ignoradas.
+    """
+    try:
+        archive = zipfile.ZipFile(zip_file)
+    except (zipfile.BadZipFile, OSError):
+        return
+
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            nome = info.filename.lower()
+            try:
+                if nome.endswith('.xml'):
+                    if info.file_size <= MAX_XML_SIZE:
+                        yield archive.read(info)
+                elif nome.endswith('.zip') and depth < MAX_NESTING:
+                    yield from _iter_nested(archive, info, depth + 1)
+            except (zipfile.BadZipFile, zlib.error, OSError, RuntimeError, EOFError):
+                # Membro corrompido ou protegido por senha
+                continue
+
+
+def _iter_nested(archive, info, depth):
+    """XMLs de um ZIP dentro do ZIP, sem ler o membro inteiro para a memória"""
+    with archive.open(info) as member:
+        if info.compress_type == zipfile.ZIP_STORED:
+            # Membro sem compressão: o ZipFile interno busca direto no externo
+            yield from iter_zip_xmls(member, depth)
+            return
+        # Compactado: voltar atrás exigiria descompactar de novo desde o início
+        with tempfile.SpooledTemporaryFile(max_size=NESTED_SPOOL_SIZE) as spool:
+            shutil.copyfileobj(member, spool)
+            spool.seek(0)
+            yield from iter_zip_xmls(spool, depth)
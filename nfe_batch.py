@@ -0,0 +1,158 @@
+# nfe_batch.py - Lote com vários clientes: uma análise independente por emitente (e mês), em paralelo
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+from ncm_index import MONOFASICO, TRIBUTADO
+from nfe_analyzer import NFeAnalyzer, ProgressReporter
+from nfe_ncmbase import NCM_REGISTRY
+from nfe_parallel import default_workers
+from nfe_parser import chave_cnpj, chave_ano_mes
+from nfe_sefaz import CATEGORIAS
+
+# Divisões do lote: nome -> descrição
+BATCH_PARTITIONS = {
+    'cnpj': 'CNPJ do emitente',
+    'cnpj-mes': 'CNPJ do emitente e mês de emissão',
+}
+
+INDEX_COLUMNS = [
+    'CNPJ Emitente', 'Mês', 'Notas SEFAZ', 'XMLs', 'Produtos', 'XMLs não encontrados',
+    'Valor Total', 'Valor Monofásico', 'Valor Tributado', 'Situação', 'Tempo (s)', 'Pasta'
+]
+
+INDEX_FILE = 'indice.csv'
+
+
+def partition_key(chave, by_month=False):
+    """(CNPJ do emitente, AAAA-MM ou '') da chave de acesso"""
+    return chave_cnpj(chave), chave_ano_mes(chave) if by_month else ''
+
+
+def split_analyzer(analyzer, by_month=False):
+    """{(cnpj, mês): {'sefaz': {categoria: {chave: dados}}, 'xmls': [chaves]}} do que foi carregado
+
+    Notas SEFAZ de todas as categorias e XMLs vão para a partição do
+    emitente da chave; uma partição pode ter só notas ou só XMLs.
+    """
+    partitions = {}
+
+    def partition(chave):
+        key = partition_key(chave, by_month)
+        if key not in partitions:
+            partitions[key] = {'sefaz': {categoria: {} for categoria in CATEGORIAS}, 'xmls': []}
+        return partitions[key]
+
+    for categoria, notas in analyzer.notas_sefaz().items():
+        for chave, dados in notas.items():
+            partition(chave)['sefaz'][categoria][chave] = dados
+    for chave in analyzer.xmls_database.keys():
+        partition(chave)['xmls'].append(chave)
+    return partitions
+
+
+def _size(partition):
+    return sum(map(len, partition['sefaz'].values())) + len(partition['xmls'])
+
+
+def run_partition(task):
+    """Análise completa de uma partição (executada no pool); devolve (linha do índice, arquivos)"""
+    started = time.perf_counter()
+    cnpj, mes = task['key']
+    directory = os.path.join(task['output'], cnpj, mes) if mes else os.path.join(task['output'], cnpj)
+    row = dict.fromkeys(INDEX_COLUMNS, 0)
+    row.update({'CNPJ Emitente': cnpj, 'Mês': mes, 'Pasta': os.path.relpath(directory, task['output'])})
+    files = []
+    try:
+        analyzer = NFeAnalyzer(workers=1, memory_budget=task['memory_budget'])
+        # Fixada no registro: lida uma vez por processo do pool
+        for path in task['ncm']:
+            analyzer.use_ncm_base(NCM_REGISTRY.preload(path))
+        analyzer.add_notas_sefaz(task['sefaz'])
+        for chave, content, produtos in task['xmls']:
+            analyzer.add_xml(chave, content, produtos)
+
+        produtos, nao_encontrados = analyzer.process_analysis()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{task['prefix']}_{cnpj}_{mes}" if mes else f"{task['prefix']}_{cnpj}"
+        files = analyzer.generate_reports(os.path.join(directory, name), task['formats'],
+                                          reconciliation=task['reconciliation'])
+
+        # Totais direto das colunas (sem montar os detalhamentos)
+        totais = analyzer.processed_data.totals('classificacao')
+        row.update({
+            'Notas SEFAZ': len(analyzer.sefaz_autorizadas),
+            'XMLs': len(analyzer.xmls_database),
+            'Produtos': produtos,
+            'XMLs não encontrados': nao_encontrados,
+            'Valor Total': analyzer.processed_data.total(),
+            'Valor Monofásico': totais.get(MONOFASICO, (0, 0.0))[1],
+            'Valor Tributado': totais.get(TRIBUTADO, (0, 0.0))[1],
+            'Situação': 'ok',
+        })
+    except Exception as e:
+        # Um cliente com erro não interrompe o lote; o motivo fica no índice
+        row['Situação'] = f"erro: {e}"
+    row['Tempo (s)'] = round(time.perf_counter() - started, 2)
+    return row, files
+
+
+def run_batch(analyzer, ncm_paths, output, by_month=False, formats=('xlsx',), reconciliation=False,
+              workers=None, memory_budget=None, prefix='analise', progress=None):
+    """Analisa cada emitente (e mês) do analyzer carregado como um job separado
+
+    As partições rodam em um pool de processos, das maiores para as
+    menores, com no máximo 2 por processo em andamento. Cada uma grava seus
+    relatórios em output/<cnpj>[/<AAAA-MM>]; o índice consolidado
+    (indice.csv) lista todas, com totais e situação. Devolve (índice como
+    DataFrame, arquivos gravados).
+    """
+    progress = progress or ProgressReporter()
+    workers = workers or default_workers()
+    partitions = split_analyzer(analyzer, by_month)
+    ordem = sorted(partitions, key=lambda key: _size(partitions[key]), reverse=True)
+    options = {'output': output, 'ncm': list(ncm_paths), 'formats': list(formats),
+               'reconciliation': reconciliation, 'memory_budget': memory_budget, 'prefix': prefix}
+
+    def tasks():
+        # Conteúdo dos XMLs lido do disco só quando a partição é enviada
+        for key in ordem:
+            partition = partitions[key]
+            xmls = [(chave, analyzer.xmls_database[chave], analyzer.xmls_produtos.get(chave))
+                    for chave in partition['xmls']]
+            yield dict(options, key=key, sefaz=partition['sefaz'], xmls=xmls)
+
+    rows = []
+    outputs = []
+
+    def done(result):
+        row, files = result
+        rows.append(row)
+        outputs.extend(files)
+        progress.update(len(rows), len(ordem), f"Clientes... {len(rows)}/{len(ordem)}")
+
+    os.makedirs(output, exist_ok=True)
+    if workers <= 1 or len(ordem) <= 1:
+        for task in tasks():
+            done(run_partition(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            em_andamento = set()
+            for task in tasks():
+                em_andamento.add(executor.submit(run_partition, task))
+                if len(em_andamento) >= workers * 2:
+                    concluidos, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+                    for future in concluidos:
+                        done(future.result())
+            for future in em_andamento:
+                done(future.result())
+    progress.close()
+
+    index = pd.DataFrame(rows, columns=INDEX_COLUMNS).sort_values(['CNPJ Emitente', 'Mês'])
+    index = index.reset_index(drop=True)
+    index_path = os.path.join(output, INDEX_FILE)
+    index.to_csv(index_path, index=False)
+    outputs.append(index_path)
+    return index, outputs
@@ -0,0 +1,214 @@
+# nfe_cache.py - Caches de arquivos já processados
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from nfe_parser import PARSER_VERSION
+
+# Máximo de arquivos lembrados por sessão
+UPLOAD_CACHE_SIZE = 200_000
+
+MISSING = object()
+
+
+def fingerprint(data):
+    """Impressão digital (hash) de um conteúdo em bytes"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_fingerprint(file, block_size=1024 * 1024):
+    """Hash de um caminho ou arquivo aberto, sem alterar a posição de leitura"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    position = file.tell()
+    file.seek(0)
+    for block in iter(lambda: file.read(block_size), b''):
+        digest.update(block.encode('utf-8') if isinstance(block, str) else block)
+    file.seek(position)
+    return digest.hexdigest()
+
+
+class FingerprintCache:
+    """Cache LRU de resultados indexado pelo hash do conteúdo
+
+    Ao passar de max_entries, os itens usados há mais tempo são descartados.
+    """
+
+    def __init__(self, max_entries=UPLOAD_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Tamanho máximo padrão do cache persistente de notas
+NOTE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Ordem dos campos de cada produto gravado no cache
+_CAMPOS_PRODUTO = ['ncm', 'descricao', 'quantidade', 'valor_unitario',
+                   'valor_produto_xml', 'unidade', 'cfop']
+
+# Limite de parâmetros por consulta no SQLite
+_BATCH = 500
+
+
+def default_cache_dir():
+    return os.environ.get('NFE_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'analisador-nfe')
+
+
+class NoteCache:
+    """Cache persistente (SQLite) dos produtos extraídos de cada XML
+
+    Indexado pelo hash do conteúdo, com a chave da nota ao lado. Guarda os
+    produtos antes da classificação, então trocar a base NCM não invalida
+    nada: a classificação é refeita na análise. Entradas de outra versão
+    do parser são ignoradas e, ao passar de max_bytes, as notas usadas há
+    mais tempo são removidas.
+    """
+
+    def __init__(self, path, max_bytes=NOTE_CACHE_MAX_BYTES):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS notas (
+                    hash TEXT PRIMARY KEY,
+                    chave TEXT,
+                    produtos BLOB NOT NULL,
+                    tamanho INTEGER NOT NULL,
+                    versao INTEGER NOT NULL,
+                    ultimo_uso REAL NOT NULL
+                )""")
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_notas_uso ON notas (ultimo_uso)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_notas_chave ON notas (chave)')
+            self._conn.execute('DELETE FROM notas WHERE versao != ?', (PARSER_VERSION,))
+            self._total_bytes = self._conn.execute(
+                'SELECT COALESCE(SUM(tamanho), 0) FROM notas').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        """Cache em NFE_CACHE_DIR com limite NFE_CACHE_MAX_MB (0 desativa)"""
+        max_mb = int(os.environ.get('NFE_CACHE_MAX_MB', NOTE_CACHE_MAX_BYTES // (1024 * 1024)))
+        if max_mb <= 0:
+            return None
+        return cls(os.path.join(default_cache_dir(), 'notas.sqlite'), max_mb * 1024 * 1024)
+
+    @staticmethod
+    def _dump(produtos):
+        linhas = [[produto[campo] for campo in _CAMPOS_PRODUTO] for produto in produtos]
+        return zlib.compress(json.dumps(linhas, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _load(blob):
+        linhas = json.loads(zlib.decompress(blob))
+        return [dict(zip(_CAMPOS_PRODUTO, linha)) for linha in linhas]
+
+    def get_many(self, hashes):
+        """{hash: (chave, produtos)} das notas encontradas no cache"""
+        found = {}
+        agora = time.time()
+        with self._lock, self._conn:
+            for i in range(0, len(hashes), _BATCH):
+                lote = hashes[i:i + _BATCH]
+                marks = ','.join('?' * len(lote))
+                rows = self._conn.execute(
+                    f'SELECT hash, chave, produtos FROM notas WHERE hash IN ({marks})', lote).fetchall()
+                for hash_, chave, blob in rows:
+                    found[hash_] = (chave, self._load(blob))
+                if rows:
+                    self._conn.execute(
+                        f'UPDATE notas SET ultimo_uso = ? WHERE hash IN ({marks})', [agora] + lote)
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Grava [(hash, (chave, produtos))] e aplica o limite de tamanho"""
+        agora = time.time()
+        rows = []
+        for hash_, (chave, produtos) in items:
+            blob = self._dump(produtos)
+            rows.append((hash_, chave, blob, len(blob), PARSER_VERSION, agora))
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO notas VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._total_bytes += sum(row[3] for row in rows)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove as notas menos usadas até ficar em 90% do limite"""
+        self._total_bytes = self._conn.execute(
+            'SELECT COALESCE(SUM(tamanho), 0) FROM notas').fetchone()[0]
+        excesso = self._total_bytes - int(self.max_bytes * 0.9)
+        if excesso <= 0:
+            return
+        remover = []
+        for hash_, tamanho in self._conn.execute('SELECT hash, tamanho FROM notas ORDER BY ultimo_uso'):
+            remover.append((hash_,))
+            excesso -= tamanho
+            self._total_bytes -= tamanho
+            if excesso <= 0:
+                break
+        self._conn.executemany('DELETE FROM notas WHERE hash = ?', remover)
+
+    def invalidate(self, chaves=None):
+        """Remove as notas das chaves informadas (ou todo o cache)"""
+        with self._lock, self._conn:
+            if chaves is None:
+                self._conn.execute('DELETE FROM notas')
+            else:
+                self._conn.executemany('DELETE FROM notas WHERE chave = ?', [(c,) for c in chaves])
+            self._total_bytes = self._conn.execute(
+                'SELECT COALESCE(SUM(tamanho), 0) FROM notas').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM notas').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
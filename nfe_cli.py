@@ -0,0 +1,192 @@
+# nfe_cli.py - Execução em lote (sem Streamlit) do Analisador NFe
+#
+# Exemplo:
+#   python nfe_cli.py --ncm base_ncm.xlsx --sefaz sefaz/*.csv --xml xmls/ notas.zip \
+#       --output saida/ --format xlsx parquet csv --partition-by cnpj
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from nfe_analyzer import NFeAnalyzer, ProgressReporter
+from nfe_batch import BATCH_PARTITIONS, run_batch
+from nfe_cache import NoteCache
+from nfe_diagnostics import Diagnostics
+from nfe_reconcile import BUCKETS
+from nfe_watch import FileIndex, FolderWatcher
+
+
+class TextProgress(ProgressReporter):
+    """Progresso no stderr, no máximo uma linha por intervalo"""
+
+    def __init__(self, stream=sys.stderr, interval=1.0):
+        self.stream = stream
+        self.interval = interval
+        self._last = 0.0
+
+    def update(self, done, total, message=''):
+        now = time.monotonic()
+        if done == total or now - self._last >= self.interval:
+            self._last = now
+            self.stream.write(f"\r{message}")
+            self.stream.flush()
+
+    def close(self):
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+def expand_paths(patterns, extensions):
+    """Expande arquivos, pastas (recursivamente) e globs, sem repetições"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    dirs.sort()
+                    paths.extend(os.path.join(root, f) for f in sorted(files)
+                                 if f.lower().endswith(extensions))
+            elif os.path.isfile(match):
+                paths.append(match)
+            else:
+                raise FileNotFoundError(f"Arquivo não encontrado: {pattern}")
+    return list(dict.fromkeys(paths))
+
+
+def read_files(paths):
+    for path in paths:
+        with open(path, 'rb') as f:
+            yield f.read()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Análise NFe x SEFAZ em lote (NCM Excel + CSV SEFAZ + XMLs)")
+    parser.add_argument('--ncm', required=True, nargs='+', help="Planilha(s) NCM (.xlsx/.xls)")
+    parser.add_argument('--sefaz', required=True, nargs='+', help="CSV(s) da SEFAZ, pastas ou globs")
+    parser.add_argument('--xml', nargs='+', default=[], help="XMLs, ZIPs, pastas ou globs")
+    parser.add_argument('--watch', nargs='+', default=[], metavar='PASTA',
+                        help="Pastas monitoradas: só arquivos novos ou alterados desde a última execução são lidos")
+    parser.add_argument('--output', default='.', help="Pasta de saída (padrão: atual)")
+    parser.add_argument('--format', nargs='+', choices=['xlsx', 'parquet', 'csv'], default=['xlsx'],
+                        help="Formatos de saída (padrão: xlsx; csv é compactado com gzip)")
+    parser.add_argument('--partition-by', choices=['classificacao', 'cnpj'], default=None,
+                        help="Grava Parquet/CSV em uma pasta, um arquivo por classificação ou CNPJ emitente")
+    parser.add_argument('--prefix', default='analise_detalhada_nfe', help="Prefixo dos arquivos gerados")
+    parser.add_argument('--workers', type=int, default=None, help="Processos na leitura dos XMLs")
+    parser.add_argument('--no-cache', action='store_true', help="Não usar o cache persistente de notas")
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help="Orçamento de memória; perto dele os produtos processados vão para o disco "
+                             "(padrão: NFE_MEMORY_BUDGET_MB ou sem limite)")
+    parser.add_argument('--quiet', action='store_true', help="Não exibir o progresso")
+    parser.add_argument('--reconciliation', action='store_true',
+                        help="Grava as listas da conciliação SEFAZ x XMLs (CSV gzip por grupo)")
+    parser.add_argument('--batch-by', choices=list(BATCH_PARTITIONS), default=None,
+                        help="Lote de vários clientes: uma análise e uma pasta de relatórios por CNPJ emitente "
+                             "(ou CNPJ e mês), rodando em paralelo, e um índice consolidado")
+    parser.add_argument('--batch-workers', type=int, default=None,
+                        help="Processos do lote (padrão: NFE_WORKERS ou nº de CPUs)")
+    parser.add_argument('--diagnostics', metavar='ARQUIVO',
+                        help="Grava tempo/memória por etapa e contadores de falhas em JSON")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Mede também o pico do tracemalloc em cada etapa (mais lento)")
+    parser.add_argument('--profile', metavar='ARQUIVO',
+                        help="Grava um perfil cProfile da execução (pstats)")
+    args = parser.parse_args(argv)
+    if not args.xml and not args.watch:
+        parser.error("informe --xml e/ou --watch")
+    return args
+
+
+def run(args):
+    """Executa a análise e devolve a lista de arquivos gerados"""
+    note_cache = None
+    if not args.no_cache:
+        try:
+            note_cache = NoteCache.from_env()
+        except (OSError, sqlite3.Error):
+            pass
+    memory_budget = int(args.memory_budget * 1024 * 1024) if args.memory_budget else None
+    analyzer = NFeAnalyzer(workers=args.workers, note_cache=note_cache,
+                           diagnostics=Diagnostics(trace_memory=args.trace_memory),
+                           memory_budget=memory_budget)
+    log = (lambda *a: None) if args.quiet else (lambda *a: print(*a, file=sys.stderr))
+
+    ncm_paths = expand_paths(args.ncm, ('.xlsx', '.xls'))
+    for path in ncm_paths:
+        result = analyzer.load_ncm_database(path)
+        if not result[0]:
+            raise RuntimeError(f"Erro na base NCM {path}: {result[1]}")
+        log(f"NCM {path}: {result[1]} NCMs | Monofásicos: {result[2]} | Tributados: {result[3]}")
+
+    for path in expand_paths(args.sefaz, ('.csv',)):
+        result = analyzer.load_sefaz_database(path)
+        if not result[0]:
+            raise RuntimeError(f"Erro no CSV SEFAZ {path}: {result[1]}")
+        log(f"SEFAZ {path}: {result[1]} notas autorizadas | Valor total: R$ {result[2]:,.2f}")
+
+    xml_paths = expand_paths(args.xml, ('.xml', '.zip'))
+    zip_paths = [p for p in xml_paths if p.lower().endswith('.zip')]
+    xmls_count = analyzer.ingest_xml_contents(
+        read_files(p for p in xml_paths if not p.lower().endswith('.zip')))
+    for path in zip_paths:
+        with open(path, 'rb') as f:
+            xmls_count += analyzer.process_zip_files([f])
+    if args.watch:
+        index = FileIndex.default()
+        for directory in args.watch:
+            contagem = FolderWatcher(directory, analyzer, index).refresh()
+            xmls_count += contagem['notas']
+            log(f"Pasta {directory}: {contagem['arquivos']} arquivos | {contagem['lidos']} lidos "
+                f"({contagem['novos']} novos, {contagem['alterados']} alterados)")
+        index.close()
+    log(f"XMLs: {xmls_count} processados")
+
+    os.makedirs(args.output, exist_ok=True)
+    base = os.path.join(args.output, f"{args.prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    progress = ProgressReporter() if args.quiet else TextProgress()
+    if args.batch_by:
+        indice, outputs = run_batch(analyzer, ncm_paths, base, by_month=args.batch_by == 'cnpj-mes',
+                                    formats=args.format, reconciliation=args.reconciliation,
+                                    workers=args.batch_workers, memory_budget=memory_budget,
+                                    prefix=args.prefix, progress=progress)
+        erros = int(indice['Situação'].str.startswith('erro').sum())
+        log(f"Lote concluído: {len(indice)} partições | {erros} com erro | índice em {outputs[-1]}")
+    else:
+        produtos_count, nao_encontrados = analyzer.process_analysis(progress)
+        log(f"Análise concluída: {produtos_count} produtos | {nao_encontrados} XMLs não encontrados")
+        if analyzer.processed_data.spilled:
+            log(f"Produtos gravados em disco (orçamento de memória): {analyzer.processed_data.spill_dir}")
+        conciliacao = analyzer.reconcile()
+        for name, titulo in BUCKETS.items():
+            log(f"  {titulo}: {conciliacao.count(name)} notas | R$ {conciliacao.total(name):,.2f}")
+        outputs = analyzer.generate_reports(base, args.format, args.partition_by, args.reconciliation)
+    if args.diagnostics:
+        with open(args.diagnostics, 'w', encoding='utf-8') as f:
+            f.write(analyzer.diagnostics_json())
+    return outputs
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.profile:
+            # Perfil gravado mesmo se a execução falhar
+            with Diagnostics().profile(args.profile):
+                outputs = run(args)
+        else:
+            outputs = run(args)
+    except (OSError, RuntimeError, ImportError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    for path in outputs:
+        print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# nfe_diagnostics.py - Tempo, memória e contadores de falhas por etapa da análise
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Etapas guardadas (as mais antigas são descartadas)
+MAX_STAGES = 200
+
+# Intervalo de amostragem da memória residente, em segundos
+RSS_INTERVAL = 0.02
+
+
+def current_rss():
+    """Memória residente do processo em bytes (Linux); senão o pico até agora
+
+    None onde nenhuma das duas leituras existe (Windows).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RSSSampler:
+    """Thread única do processo que amostra a memória residente das etapas em andamento
+
+    Cada medição abre uma janela (start/peak); a thread só amostra enquanto
+    há janelas abertas e fica parada entre elas, então etapas curtas ou
+    reaproveitadas do cache não criam threads.
+    """
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self._windows = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def open(self, window):
+        with self._lock:
+            self._windows.add(window)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='nfe-rss', daemon=True)
+                self._thread.start()
+            self._wake.set()
+
+    def close(self, window):
+        with self._lock:
+            self._windows.discard(window)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._windows:
+                    self._wake.clear()
+                    continue
+            rss = current_rss()
+            with self._lock:
+                for window in self._windows:
+                    window.peak = max(window.peak, rss)
+            time.sleep(self.interval)
+
+
+_SAMPLER = RSSSampler()
+
+
+class PeakMemory:
+    """Pico da memória residente enquanto o bloco executa (amostrado pelo RSSSampler)
+
+    start e peak ficam None quando a plataforma não informa a memória.
+    """
+
+    def __init__(self, sampler=None):
+        self.sampler = sampler or _SAMPLER
+        self.start = self.peak = None
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        if self.start is not None:
+            self.sampler.open(self)
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is None:
+            return
+        self.sampler.close(self)
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self):
+        return None if self.start is None else self.peak - self.start
+
+
+class _Tracing:
+    """Liga o tracemalloc (que vale para o processo todo) para as etapas que o pedem
+
+    A primeira etapa em andamento liga e a última desliga; threads
+    diferentes podem medir ao mesmo tempo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = 0
+        self._owned = False
+
+    def acquire(self):
+        with self._lock:
+            if self._users == 0:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._owned = True
+                else:
+                    tracemalloc.reset_peak()
+            self._users += 1
+
+    def release(self):
+        """Pico desde o acquire mais externo"""
+        with self._lock:
+            peak = tracemalloc.get_traced_memory()[1]
+            self._users -= 1
+            if self._users == 0 and self._owned:
+                tracemalloc.stop()
+                self._owned = False
+            return peak
+
+
+_TRACING = _Tracing()
+
+
+class StageRecord:
+    """Medições de uma execução de etapa; items é preenchido por quem mede
+
+    cached=True indica que a etapa só reaproveitou um resultado (ex.: o
+    mesmo arquivo de novo a cada reexecução do Streamlit): o registro é
+    descartado para não tirar do histórico as etapas que fizeram trabalho.
+    """
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.cached = False
+        self.items = 0
+        self.seconds = 0.0
+        self.peak_rss = None
+        self.rss_growth = None
+        self.traced_peak = None
+        self.failed = False
+
+    def to_dict(self):
+        mb = 1024 * 1024
+        return {
+            'stage': self.name,
+            'seconds': round(self.seconds, 4),
+            'items': self.items,
+            'unit': self.unit,
+            'throughput': round(self.items / self.seconds, 1) if self.seconds > 0 else None,
+            'peak_rss_mb': round(self.peak_rss / mb, 1) if self.peak_rss is not None else None,
+            'rss_growth_mb': round(self.rss_growth / mb, 1) if self.rss_growth is not None else None,
+            'tracemalloc_peak_mb': round(self.traced_peak / mb, 1) if self.traced_peak is not None else None,
+            'failed': self.failed,
+        }
+
+
+class Diagnostics:
+    """Registro das etapas do NFeAnalyzer e dos erros que não interrompem a análise
+
+    Cada etapa guarda tempo, itens processados, vazão e pico de memória
+    residente. Com trace_memory, o pico do tracemalloc também é medido
+    (mais lento). Os contadores somam falhas como XMLs ilegíveis.
+    """
+
+    def __init__(self, trace_memory=False, max_stages=MAX_STAGES):
+        self.trace_memory = trace_memory
+        self.stages = deque(maxlen=max_stages)
+        self.counters = Counter()
+        self.profile_report = None
+
+    def count(self, name, n=1):
+        if n:
+            self.counters[name] += n
+
+    @contextmanager
+    def stage(self, name, unit='itens'):
+        """Mede o bloco como a etapa name; atribua record.items dentro dele"""
+        record = StageRecord(name, unit)
+        tracing = self.trace_memory
+        if tracing:
+            _TRACING.acquire()
+        memory = PeakMemory()
+        memory.__enter__()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record.failed = True
+            raise
+        finally:
+            record.seconds = time.perf_counter() - start
+            memory.__exit__()
+            record.peak_rss = memory.peak
+            record.rss_growth = memory.growth
+            if tracing:
+                record.traced_peak = _TRACING.release()
+            if not record.cached:
+                self.stages.append(record)
+
+    @contextmanager
+    def profile(self, path=None, limit=40):
+        """Captura um perfil cProfile do bloco (somente o processo atual)
+
+        O resumo (funções por tempo acumulado) fica em profile_report; com
+        path, as estatísticas completas também são gravadas para o pstats.
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+            self.profile_report = out.getvalue()
+            if path is not None:
+                profiler.dump_stats(path)
+
+    def clear(self):
+        self.stages.clear()
+        self.counters.clear()
+        self.profile_report = None
+
+    def to_dict(self):
+        return {
+            'stages': [record.to_dict() for record in self.stages],
+            'counters': dict(self.counters),
+            'profile': self.profile_report,
+        }
+
+    def to_json(self, extra=None):
+        report = self.to_dict()
+        if extra:
+            report.update(extra)
+        return json.dumps(report, ensure_ascii=False, indent=2)
@@ -0,0 +1,96 @@
+# nfe_explorer.py - Filtro, ordenação e paginação dos produtos processados
+import numpy as np
+import pandas as pd
+
+# Colunas exibidas no explorador: coluna -> título
+EXPLORER_COLUMNS = {
+    'descricao': 'Descrição',
+    'ncm': 'NCM',
+    'classificacao': 'Classificação',
+    'cfop': 'CFOP',
+    'quantidade': 'Quantidade',
+    'valor_unitario': 'Valor Unitário',
+    'valor_produto_proporcional': 'Valor (SEFAZ)',
+    'chave_nfe': 'Chave NFe',
+}
+
+PAGE_SIZE = 50
+
+
+class ResultsIndex:
+    """Índice dos produtos para consultas sem montar o DataFrame inteiro
+
+    NCM e descrição são numerados (string_codes) uma única vez; filtros de
+    texto rodam só sobre os valores distintos e viram máscaras sobre os
+    códigos de cada linha. As consultas devolvem arrays de linhas, e apenas
+    a página pedida é convertida em DataFrame.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._codes = {}
+        self._uniques = {}
+        for col in ('ncm', 'descricao'):
+            codes, uniques = store.string_codes(col)
+            self._codes[col] = codes
+            self._uniques[col] = pd.Series(uniques, dtype=object)
+        for col, column in store.categorical.items():
+            self._codes[col] = column.view()
+            self._uniques[col] = pd.Series(column.categories, dtype=object)
+
+    def __len__(self):
+        return len(self.store)
+
+    def values(self, column):
+        """Valores distintos da coluna categórica (para as opções dos filtros)"""
+        return sorted(self._uniques[column][np.unique(self._codes[column])].tolist())
+
+    def _match(self, column, matches):
+        """Máscara por linha a partir da máscara sobre os valores distintos"""
+        return np.asarray(matches, dtype=bool)[self._codes[column]]
+
+    def query(self, classificacao=None, cfop=None, ncm_prefix='', chave='', texto=''):
+        """Linhas (array de índices, na ordem original) que atendem a todos os filtros
+
+        classificacao/cfop são listas de valores aceitos (vazio = todos);
+        ncm_prefix filtra pelo início do NCM, chave por trecho da chave e
+        texto por trecho da descrição (sem diferenciar maiúsculas).
+        """
+        mask = np.ones(len(self.store), dtype=bool)
+        for column, selected in (('classificacao', classificacao), ('cfop', cfop)):
+            if selected:
+                mask &= self._match(column, self._uniques[column].isin(selected))
+        if ncm_prefix:
+            mask &= self._match('ncm', self._uniques['ncm'].str.startswith(ncm_prefix.strip(), na=False))
+        if chave:
+            mask &= self._match('chave_nfe', self._uniques['chave_nfe'].str.contains(
+                chave.strip(), regex=False, na=False))
+        if texto:
+            mask &= self._match('descricao', self._uniques['descricao'].str.contains(
+                texto.strip(), case=False, regex=False, na=False))
+        return np.flatnonzero(mask)
+
+    def _sort_key(self, column):
+        if column in self.store.numeric:
+            return self.store.numeric[column].view()
+        # Posição de cada valor distinto na ordem alfabética
+        uniques = self._uniques[column]
+        rank = np.empty(len(uniques), dtype=np.int64)
+        rank[np.argsort(uniques.to_numpy(dtype=str), kind='stable')] = np.arange(len(uniques))
+        return rank[self._codes[column]]
+
+    def sort(self, rows, column, ascending=True):
+        """Reordena as linhas pela coluna (estável: empates mantêm a ordem original)"""
+        if column is None or not len(rows):
+            return rows
+        keys = self._sort_key(column)[rows]
+        if not ascending:
+            keys = -keys
+        return rows[np.argsort(keys, kind='stable')]
+
+    def page(self, rows, number, size=PAGE_SIZE, columns=EXPLORER_COLUMNS):
+        """DataFrame só com as linhas da página (numerada a partir de 0)"""
+        page_rows = rows[number * size:(number + 1) * size]
+        frame = self.store.to_dataframe(list(columns), rows=page_rows)
+        frame.index = page_rows
+        return frame.rename(columns=columns)
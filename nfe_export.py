@@ -0,0 +1,306 @@
+# nfe_export.py - Exportação dos produtos processados
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+
+from nfe_aggregate import chave_codes
+from nfe_parser import chave_cnpj
+from nfe_reconcile import BUCKETS, DIVERGENCES, LIST_COLUMNS
+from nfe_store import COLUMNS, NUMERIC_COLUMNS
+
+# Linhas de dados por planilha (limite do Excel menos o cabeçalho)
+MAX_EXCEL_ROWS = 1_048_575
+
+# Linhas convertidas por vez a partir das colunas
+ROWS_PER_BATCH = 50_000
+
+DETAIL_SHEET = 'Análise Detalhada'
+
+# Colunas do relatório detalhado: (cabeçalho, largura)
+DETAIL_COLUMNS = [
+    ('Nome do Produto', 50),
+    ('Valor Total', 15),
+    ('NCM', 10),
+    ('Classificação', 15),
+    ('Quantidade', 12),
+    ('Valor Unitário', 15),
+    ('Nota Fiscal', 45),
+    ('CFOP', 8),
+    ('Unidade', 10),
+    ('Observações', 40),
+]
+
+# Colunas do relatório detalhado com formato monetário
+MONEY_COLUMNS = {'Valor Total', 'Valor Unitário'}
+
+
+def _labels(store, name, fmt=None):
+    """Valores da coluna categórica já formatados, indexáveis pelo código"""
+    categories = store.categorical[name].categories
+    if fmt is not None:
+        categories = [fmt(value) for value in categories]
+    return np.array(categories, dtype=object)
+
+
+def _numbers(values):
+    """Lista de números com NaN trocado por célula vazia"""
+    if np.isnan(values).any():
+        values = values.astype(object)
+        values[np.isnan(values.astype(float))] = None
+    return values.tolist()
+
+
+def iter_detail_rows(store, batch_size=ROWS_PER_BATCH):
+    """Gera blocos de linhas (tuplas) do relatório detalhado
+
+    As linhas são montadas bloco a bloco direto das colunas do ProductStore,
+    sem dicionários ou DataFrame intermediários.
+    """
+    classificacao = _labels(store, 'classificacao')
+    nota = _labels(store, 'chave_nfe', lambda chave: f"NFe_{chave}")
+    cfop = _labels(store, 'cfop')
+    unidade = _labels(store, 'unidade')
+    observacao = _labels(store, 'status', lambda status: f"Encontrado na base oficial - {status}")
+
+    codes = {name: column.view() for name, column in store.categorical.items()}
+    numeric = {name: column.view() for name, column in store.numeric.items()}
+
+    for start in range(0, len(store), batch_size):
+        rows = slice(start, start + batch_size)
+        yield list(zip(
+            store.strings['descricao'][rows],
+            _numbers(numeric['valor_produto_proporcional'][rows]),
+            store.strings['ncm'][rows],
+            classificacao[codes['classificacao'][rows]].tolist(),
+            _numbers(numeric['quantidade'][rows]),
+            _numbers(numeric['valor_unitario'][rows]),
+            nota[codes['chave_nfe'][rows]].tolist(),
+            cfop[codes['cfop'][rows]].tolist(),
+            unidade[codes['unidade'][rows]].tolist(),
+            observacao[codes['status'][rows]].tolist(),
+        ))
+
+
+def _detail_sheet(workbook, number, header_format, money_format):
+    name = DETAIL_SHEET if number == 1 else f"{DETAIL_SHEET} ({number})"
+    worksheet = workbook.add_worksheet(name)
+    for col_num, (header, width) in enumerate(DETAIL_COLUMNS):
+        # Células sem formato próprio usam o da coluna
+        worksheet.set_column(col_num, col_num, width, money_format if header in MONEY_COLUMNS else None)
+        worksheet.write(0, col_num, header, header_format)
+    return worksheet
+
+
+def write_table_sheet(workbook, name, headers, rows):
+    """Planilha simples com cabeçalho no estilo padrão do pandas"""
+    header_format = workbook.add_format({
+        'bold': True,
+        'border': 1,
+        'align': 'center',
+        'valign': 'top'
+    })
+    worksheet = workbook.add_worksheet(name)
+    for col_num, header in enumerate(headers):
+        worksheet.write(0, col_num, header, header_format)
+    for row_num, row in enumerate(rows, start=1):
+        worksheet.write_row(row_num, 0, row)
+    return worksheet
+
+
+def write_detailed_excel(store, output, add_sheets=None, max_rows=MAX_EXCEL_ROWS):
+    """Grava o relatório detalhado em modo de memória constante
+
+    output é um caminho ou arquivo binário. As linhas são gravadas em ordem
+    e descarregadas no disco pelo xlsxwriter; ao passar de max_rows linhas
+    os dados continuam em 'Análise Detalhada (2)', '(3)', ... add_sheets
+    recebe o workbook para incluir planilhas extras (ex.: resumo).
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+
+    # Formatos
+    header_format = workbook.add_format({
+        'bold': True,
+        'text_wrap': True,
+        'valign': 'center',
+        'align': 'center',
+        'bg_color': '#366092',
+        'font_color': 'white',
+        'border': 1
+    })
+
+    money_format = workbook.add_format({
+        'num_format': 'R$ #,##0.00',
+        'border': 1
+    })
+
+    sheet_number = 1
+    worksheet = _detail_sheet(workbook, sheet_number, header_format, money_format)
+    row_num = 0
+    for batch in iter_detail_rows(store):
+        for row in batch:
+            if row_num == max_rows:
+                sheet_number += 1
+                worksheet = _detail_sheet(workbook, sheet_number, header_format, money_format)
+                row_num = 0
+            row_num += 1
+            worksheet.write_row(row_num, 0, row)
+
+    if add_sheets is not None:
+        add_sheets(workbook)
+
+    workbook.close()
+    return sheet_number
+
+
+# Colunas de partição aceitas pelas exportações Parquet/CSV
+PARTITIONS = {
+    'classificacao': 'classificacao',
+    'cnpj': 'cnpj_emitente',
+}
+
+EXPORT_COLUMNS = COLUMNS + ['cnpj_emitente']
+
+
+def iter_export_frames(store, batch_size=ROWS_PER_BATCH):
+    """Gera DataFrames tipados de até batch_size linhas com todas as colunas
+
+    classificacao/cfop/unidade/status/cnpj_emitente são categóricas com o
+    dicionário completo (pequeno); ncm é categórica por bloco; a chave vai
+    como texto para não repetir o dicionário de todas as notas em cada bloco.
+    """
+    chaves = _labels(store, 'chave_nfe')
+    cnpj_of_chave, cnpjs = chave_codes(store, chave_cnpj)
+    chave_rows = store.categorical['chave_nfe'].view()
+
+    for start in range(0, len(store), batch_size):
+        rows = slice(start, start + batch_size)
+        frame = {}
+        for col in EXPORT_COLUMNS:
+            if col == 'ncm':
+                frame[col] = pd.Categorical(store.strings['ncm'][rows])
+            elif col == 'chave_nfe':
+                frame[col] = chaves[chave_rows[rows]]
+            elif col == 'cnpj_emitente':
+                frame[col] = pd.Categorical.from_codes(cnpj_of_chave[chave_rows[rows]], categories=cnpjs)
+            else:
+                frame[col] = store.column(col, rows)
+        yield pd.DataFrame(frame, columns=EXPORT_COLUMNS)
+
+
+def _partition_path(directory, partition_by, value, extension):
+    """Caminho no estilo Hive: <dir>/<coluna>=<valor>/part-0<ext>"""
+    column = PARTITIONS[partition_by]
+    safe_value = str(value).replace(os.sep, '_').replace('/', '_') or 'vazio'
+    folder = os.path.join(directory, f"{column}={safe_value}")
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"part-0{extension}")
+
+
+def _iter_partitions(frames, partition_by):
+    """Gera (valor da partição ou None, DataFrame) para cada bloco"""
+    column = PARTITIONS[partition_by] if partition_by else None
+    for frame in frames:
+        if column is None:
+            yield None, frame
+            continue
+        for value, group in frame.groupby(column, sort=False, observed=True):
+            yield value, group
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    fields = []
+    for col in EXPORT_COLUMNS:
+        if col in NUMERIC_COLUMNS:
+            fields.append(pa.field(col, pa.float64()))
+        elif col in ('descricao', 'chave_nfe'):
+            fields.append(pa.field(col, pa.string()))
+        else:
+            fields.append(pa.field(col, dictionary))
+    return pa.schema(fields)
+
+
+def write_parquet(store, output, partition_by=None, batch_size=ROWS_PER_BATCH):
+    """Grava os produtos em Parquet, um row group por bloco
+
+    Sem partição, output é o arquivo. Com partition_by ('classificacao' ou
+    'cnpj'), output é uma pasta com um arquivo por valor. Retorna a lista
+    de arquivos gravados. Requer pyarrow.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Exportação Parquet requer o pacote pyarrow (pip install pyarrow)")
+
+    schema = _parquet_schema()
+    writers = {}
+    try:
+        for value, frame in _iter_partitions(iter_export_frames(store, batch_size), partition_by):
+            writer = writers.get(value)
+            if writer is None:
+                path = output if partition_by is None else _partition_path(output, partition_by, value, '.parquet')
+                writer = writers[value] = pq.ParquetWriter(path, schema, compression='snappy')
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [writer.where for writer in writers.values()]
+
+
+def write_csv_gz(store, output, partition_by=None, batch_size=ROWS_PER_BATCH):
+    """Grava os produtos em CSV compactado com gzip, bloco a bloco
+
+    Mesmas regras de output/partition_by de write_parquet. Retorna a lista
+    de arquivos gravados.
+    """
+    files = {}
+    try:
+        for value, frame in _iter_partitions(iter_export_frames(store, batch_size), partition_by):
+            handle = files.get(value)
+            header = handle is None
+            if header:
+                path = output if partition_by is None else _partition_path(output, partition_by, value, '.csv.gz')
+                handle = files[value] = gzip.open(path, 'wt', encoding='utf-8', newline='')
+            frame.to_csv(handle, index=False, header=header)
+    finally:
+        for handle in files.values():
+            handle.close()
+    return [handle.name for handle in files.values()]
+
+
+def write_reconciliation_csv(reconciliation, directory, names=None, prefix='conciliacao'):
+    """Grava cada lista da conciliação em <directory>/<prefix>_<grupo>.csv.gz
+
+    names escolhe os grupos (padrão: as divergências). Retorna a lista de
+    arquivos gravados.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for name in names or DIVERGENCES:
+        path = os.path.join(directory, f"{prefix}_{name}.csv.gz")
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as handle:
+            reconciliation.frame(name).to_csv(handle, index=False)
+        files.append(path)
+    return files
+
+
+def write_reconciliation_sheets(workbook, reconciliation, max_rows=MAX_EXCEL_ROWS):
+    """Planilha 'Conciliação' com os totais e uma planilha por divergência não vazia
+
+    Listas maiores que max_rows são cortadas (a exportação CSV traz todas).
+    """
+    summary = reconciliation.summary()
+    write_table_sheet(workbook, 'Conciliação', list(summary.columns),
+                      summary.itertuples(index=False, name=None))
+    for name in DIVERGENCES:
+        if reconciliation.count(name):
+            frame = reconciliation.frame(name).iloc[:max_rows]
+            write_table_sheet(workbook, BUCKETS[name][:31], LIST_COLUMNS,
+                              frame.itertuples(index=False, name=None))
@@ -0,0 +1,163 @@
+# nfe_jobs.py - Execução de análises em segundo plano, fora do ciclo de reexecução do Streamlit
+import threading
+import time
+import traceback
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from nfe_analyzer import ProgressReporter
+
+# Análises executadas ao mesmo tempo (cada uma já usa o pool de processos do parser)
+JOB_WORKERS = 2
+
+# Jobs concluídos guardados para consulta, e por quanto tempo (segundos)
+MAX_FINISHED_JOBS = 20
+JOB_TTL = 2 * 60 * 60
+
+# Por quanto tempo um job concluído mantém o contexto (ex.: o NFeAnalyzer) vivo
+# para reconexões pelo link; depois guarda só uma referência fraca
+JOB_CONTEXT_TTL = 15 * 60
+
+# Intervalo mínimo entre atualizações de progresso registradas
+PROGRESS_INTERVAL = 0.5
+
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDO = 'concluido'
+ERRO = 'erro'
+
+
+class JobProgress(ProgressReporter):
+    """Guarda o último andamento, no máximo uma vez por intervalo
+
+    A thread do job só grava; a interface lê done/total/message quando
+    quiser, sem uma mensagem por nota.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.done = 0
+        self.total = 0
+        self.message = ''
+        self._last = 0.0
+
+    def update(self, done, total, message=''):
+        now = time.monotonic()
+        if done == total or now - self._last >= self.interval:
+            self._last = now
+            self.done, self.total, self.message = done, total, message
+
+    @property
+    def fraction(self):
+        return self.done / self.total if self.total else 0.0
+
+
+class Job:
+    """Uma execução em segundo plano: estado, andamento e resultado"""
+
+    def __init__(self, description='', context=None, interval=PROGRESS_INTERVAL):
+        self.id = uuid.uuid4().hex[:12]
+        self.description = description
+        # Objeto sobre o qual o job trabalha (ex.: o NFeAnalyzer da sessão)
+        self._context = context
+        self._context_ref = None
+        self.status = PENDENTE
+        self.progress = JobProgress(interval)
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def context(self):
+        """Contexto do job (None depois de liberado, se nenhuma sessão ainda o usa)"""
+        if self._context_ref is not None:
+            return self._context_ref()
+        return self._context
+
+    def release_context(self):
+        """Troca a referência ao contexto por uma fraca: some quando nenhuma sessão o usa"""
+        if self._context is None:
+            return
+        try:
+            self._context_ref = weakref.ref(self._context)
+        except TypeError:
+            self._context_ref = lambda: None
+        self._context = None
+
+    @property
+    def done(self):
+        return self.status in (CONCLUIDO, ERRO)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def _run(self, func, args, kwargs):
+        self.status = EXECUTANDO
+        self.started = time.time()
+        try:
+            self.result = func(*args, progress=self.progress, **kwargs)
+            self.status = CONCLUIDO
+        except Exception:
+            self.error = traceback.format_exc()
+            self.status = ERRO
+        finally:
+            self.finished = time.time()
+
+
+class JobManager:
+    """Fila de jobs compartilhada pelo processo (sobrevive a reexecuções e reconexões)
+
+    Jobs concluídos ficam disponíveis por ttl segundos, até max_finished
+    (em todo o processo: a página guarda o seu job na sessão e não depende
+    desta lista). O contexto de um job concluído é mantido por context_ttl
+    segundos e depois só enquanto alguma sessão ainda o usa.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_finished=MAX_FINISHED_JOBS, ttl=JOB_TTL,
+                 context_ttl=JOB_CONTEXT_TTL):
+        self.max_finished = max_finished
+        self.ttl = ttl
+        self.context_ttl = context_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='nfe-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, description='', context=None, **kwargs):
+        """Agenda func(*args, progress=..., **kwargs) e devolve o Job"""
+        job = Job(description, context)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(job._run, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _prune(self):
+        agora = time.time()
+        concluidos = [job for job in self._jobs.values() if job.done]
+        excesso = len(concluidos) - self.max_finished
+        for job in concluidos:
+            if excesso > 0 or agora - job.finished > self.ttl:
+                del self._jobs[job.id]
+                job.release_context()
+                excesso -= 1
+            elif agora - job.finished > self.context_ttl:
+                job.release_context()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
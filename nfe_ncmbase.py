@@ -0,0 +1,109 @@
+# nfe_ncmbase.py - Bases NCM somente leitura compartilhadas por todas as sessões do processo
+import os
+import threading
+import time
+import weakref
+from types import MappingProxyType
+
+from nfe_cache import file_fingerprint
+from ncm_index import NCMIndex, read_ncm_excel, count_labels
+
+
+class NCMBase:
+    """Base NCM carregada de uma planilha, identificada pelo hash do conteúdo
+
+    table (NCM -> classificação) é somente leitura e index é o NCMIndex já
+    montado; sessões diferentes usam o mesmo objeto em vez de copiar.
+    """
+
+    def __init__(self, version, ncms, classificacoes, source=''):
+        self.version = version
+        self.source = source
+        self.table = MappingProxyType(dict(zip(ncms.tolist(), classificacoes.tolist())))
+        self.count_monofasico, self.count_tributado = count_labels(classificacoes)
+        self.index = NCMIndex(self.table)
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.table)
+
+    @classmethod
+    def load(cls, excel_file, usecols=None, version=None):
+        version = version or file_fingerprint(excel_file)
+        if not isinstance(excel_file, (str, os.PathLike)):
+            excel_file.seek(0)
+        ncms, classificacoes = read_ncm_excel(excel_file, usecols)
+        source = excel_file if isinstance(excel_file, (str, os.PathLike)) else getattr(excel_file, 'name', '')
+        return cls(version, ncms, classificacoes, str(source))
+
+
+class NCMRegistry:
+    """Bases NCM do processo, uma por versão (hash do arquivo + colunas lidas)
+
+    Cada versão é lida uma única vez, mesmo com várias sessões pedindo ao
+    mesmo tempo. O registro guarda só referências fracas: uma versão que
+    nenhuma sessão usa mais é descartada, exceto as fixadas com pin (ex.:
+    a base pré-carregada na inicialização).
+    """
+
+    def __init__(self):
+        self._bases = weakref.WeakValueDictionary()
+        self._pinned = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.hits = 0
+
+    def get(self, excel_file, usecols=None, pin=False, fingerprint=None):
+        """NCMBase do arquivo, lendo a planilha só se a versão ainda não existe"""
+        version = fingerprint or file_fingerprint(excel_file)
+        if usecols is not None:
+            version = f"{version}:{usecols}"
+
+        with self._lock:
+            base = self._bases.get(version)
+            if base is None:
+                loading = self._loading.setdefault(version, threading.Lock())
+            else:
+                self.hits += 1
+
+        if base is None:
+            with loading:
+                with self._lock:
+                    base = self._bases.get(version)
+                if base is None:
+                    base = NCMBase.load(excel_file, usecols, version)
+                    with self._lock:
+                        self._bases[version] = base
+                        self.loads += 1
+                else:
+                    self.hits += 1
+            with self._lock:
+                self._loading.pop(version, None)
+
+        if pin:
+            with self._lock:
+                self._pinned[version] = base
+        return base
+
+    def preload(self, path, usecols=None):
+        """Carrega e fixa a base de um arquivo local (não é descartada)"""
+        return self.get(path, usecols, pin=True)
+
+    def unpin(self, version):
+        with self._lock:
+            self._pinned.pop(version, None)
+
+    def versions(self):
+        """[(versão, NCMs, origem, fixada)] das bases ainda em uso"""
+        with self._lock:
+            return [(version, len(base), base.source, version in self._pinned)
+                    for version, base in list(self._bases.items())]
+
+    def stats(self):
+        return {'versoes': len(self._bases), 'fixadas': len(self._pinned),
+                'carregamentos': self.loads, 'hits': self.hits}
+
+
+# Registro padrão, compartilhado por todos os NFeAnalyzer do processo
+NCM_REGISTRY = NCMRegistry()
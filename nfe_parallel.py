@@ -0,0 +1,118 @@
+# nfe_parallel.py - Ingestão paralela de XMLs NFe em um pool de processos
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+from nfe_cache import fingerprint
+from nfe_parser import parse_nfe
+
+# Abaixo deste número de arquivos o processamento é serial
+MIN_PARALLEL_FILES = 200
+
+# Quantidade de XMLs enviada a cada tarefa do pool
+FILES_PER_CHUNK = 100
+
+
+def default_workers():
+    """Número de processos: variável NFE_WORKERS ou total de CPUs"""
+    try:
+        workers = int(os.environ.get('NFE_WORKERS', 0))
+    except ValueError:
+        workers = 0
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def parse_chunk(contents):
+    """Processa um bloco de XMLs (executado dentro do pool)"""
+    resultados = []
+    for content in contents:
+        try:
+            resultados.append(parse_nfe(content))
+        except Exception:
+            resultados.append((None, []))
+    return resultados
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _lookup(chunk, cache, hashed=False):
+    """Consulta o cache do bloco: (resultados ou None, hashes, pendentes)
+
+    Com hashed, o bloco tem pares (hash, content) e o hash não é refeito.
+    """
+    if hashed:
+        hashes = [hash_ for hash_, _ in chunk]
+        contents = [content for _, content in chunk]
+    else:
+        hashes, contents = None, chunk
+    if cache is None:
+        return [None] * len(chunk), hashes, contents
+    if hashes is None:
+        hashes = [fingerprint(content) for content in contents]
+    found = cache.get_many(hashes)
+    cached = [found.get(hash_) for hash_ in hashes]
+    return cached, hashes, [c for c, r in zip(contents, cached) if r is None]
+
+
+def _merge(chunk, cached, hashes, parsed, cache):
+    """Junta resultados do cache e recém-processados na ordem do bloco"""
+    parsed = iter(parsed)
+    resultados = []
+    novos = []
+    for i, resultado in enumerate(cached):
+        if resultado is None:
+            resultado = next(parsed)
+            if cache is not None:
+                novos.append((hashes[i], resultado))
+        resultados.append(resultado)
+    if novos:
+        cache.put_many(novos)
+    return zip(chunk, resultados)
+
+
+def parse_many(contents, workers=None, min_parallel=MIN_PARALLEL_FILES,
+               chunk_size=FILES_PER_CHUNK, cache=None, hashed=False):
+    """Gera (content, (chave, produtos)) para cada XML, na ordem de entrada
+
+    Os blocos são distribuídos entre os processos, mas os resultados são
+    devolvidos na mesma ordem do processamento serial. Com poucos arquivos
+    (ou workers=1) tudo roda no processo atual. contents pode ser um
+    gerador: apenas os blocos em andamento ficam em memória. Com cache
+    (NoteCache), notas já conhecidas não são processadas de novo. Com
+    hashed, contents traz pares (hash, content) já calculados pelo chamador
+    (fingerprint) e cada par volta no lugar do content.
+    """
+    workers = workers or default_workers()
+    iterator = iter(contents)
+    inicio = list(islice(iterator, min_parallel))
+
+    if workers <= 1 or len(inicio) < min_parallel:
+        for chunk in _chunks(chain(inicio, iterator), chunk_size):
+            cached, hashes, pendentes = _lookup(chunk, cache, hashed)
+            yield from _merge(chunk, cached, hashes, parse_chunk(pendentes), cache)
+        return
+
+    if hasattr(contents, '__len__'):
+        chunk_size = max(1, min(chunk_size, len(contents) // (workers * 4)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Mantém no máximo 2 blocos por processo em andamento
+        em_andamento = deque()
+        for chunk in _chunks(chain(inicio, iterator), chunk_size):
+            cached, hashes, pendentes = _lookup(chunk, cache, hashed)
+            future = executor.submit(parse_chunk, pendentes) if pendentes else None
+            em_andamento.append((chunk, cached, hashes, future))
+            if len(em_andamento) >= workers * 2:
+                chunk, cached, hashes, future = em_andamento.popleft()
+                yield from _merge(chunk, cached, hashes, future.result() if future else [], cache)
+        while em_andamento:
+            chunk, cached, hashes, future = em_andamento.popleft()
+            yield from _merge(chunk, cached, hashes, future.result() if future else [], cache)
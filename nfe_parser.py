@@ -0,0 +1,168 @@
+# nfe_parser.py - Parser incremental de XMLs NFe (uma única leitura por documento)
+import xml.etree.ElementTree as ET
+
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+
+# Incrementar quando o formato dos produtos extraídos mudar (invalida caches)
+PARSER_VERSION = 1
+
+# Tamanho dos blocos lidos de arquivos/streams
+CHUNK_SIZE = 64 * 1024
+
+
+def _tags(nome):
+    """Tag qualificada com o namespace NFe e a versão sem namespace"""
+    return frozenset(('{%s}%s' % (NFE_NS, nome), nome))
+
+
+TAG_INFNFE = _tags('infNFe')
+TAG_CHNFE = _tags('chNFe')
+TAG_DET = _tags('det')
+TAG_PROD = _tags('prod')
+
+# Campos de <prod>: tag -> (chave no dicionário, numérico)
+_CAMPOS = {
+    'NCM': ('ncm', False),
+    'xProd': ('descricao', False),
+    'qCom': ('quantidade', True),
+    'vUnCom': ('valor_unitario', True),
+    'vProd': ('valor_produto_xml', True),
+    'uCom': ('unidade', False),
+    'CFOP': ('cfop', False),
+}
+CAMPOS_PROD = {tag: campo for nome, campo in _CAMPOS.items() for tag in _tags(nome)}
+
+
+def only_digits(texto):
+    """Mantém apenas os dígitos do texto"""
+    return ''.join(c for c in texto if c.isdigit())
+
+
+def chave_cnpj(chave):
+    """CNPJ do emitente contido na chave de acesso (posições 7 a 20)"""
+    return chave[6:20]
+
+
+def chave_ano_mes(chave):
+    """Ano/mês de emissão contidos na chave de acesso, no formato AAAA-MM"""
+    return f"20{chave[2:4]}-{chave[4:6]}"
+
+
+def _chave_from_id(id_attr):
+    """Extrai a chave do atributo Id do infNFe (None se não for uma chave)"""
+    if id_attr.startswith('NFe'):
+        return only_digits(id_attr[3:])
+    elif len(id_attr) == 44:
+        return only_digits(id_attr)
+    return None
+
+
+def _to_float(texto):
+    try:
+        return float(texto) if texto else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _iter_events(xml_content, events=('start', 'end')):
+    """Gera os eventos do parser alimentando-o em blocos"""
+    parser = ET.XMLPullParser(events=events)
+    if hasattr(xml_content, 'read'):
+        while True:
+            chunk = xml_content.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from parser.read_events()
+    else:
+        parser.feed(xml_content)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _parse(xml_content):
+    chave = None
+    chave_ch = None
+    produtos = []
+    campos = None
+    det_com_prod = False
+
+    for event, elem in _iter_events(xml_content):
+        tag = elem.tag
+        if event == 'start':
+            if chave is None and tag in TAG_INFNFE:
+                chave = _chave_from_id(elem.get('Id', ''))
+            elif tag in TAG_PROD and not det_com_prod:
+                campos = {}
+                det_com_prod = True
+            elif tag in TAG_DET:
+                det_com_prod = False
+            continue
+
+        if campos is not None:
+            campo = CAMPOS_PROD.get(tag)
+            if campo is not None and campo[0] not in campos:
+                texto = elem.text.strip() if elem.text else ''
+                campos[campo[0]] = _to_float(texto) if campo[1] else texto
+            elif tag in TAG_PROD:
+                ncm = campos.get('ncm', '')
+                valor_produto = campos.get('valor_produto_xml', 0.0)
+                if ncm and valor_produto > 0:
+                    produtos.append({
+                        'ncm': ncm,
+                        'descricao': campos.get('descricao') or 'Produto sem descrição',
+                        'quantidade': campos.get('quantidade', 0.0),
+                        'valor_unitario': campos.get('valor_unitario', 0.0),
+                        'valor_produto_xml': valor_produto,
+                        'unidade': campos.get('unidade') or 'UN',
+                        'cfop': campos.get('cfop') or ''
+                    })
+                campos = None
+        elif chave_ch is None and tag in TAG_CHNFE:
+            chave_ch = only_digits(elem.text.strip() if elem.text else '')
+
+        # Elemento já consumido: libera os filhos
+        elem.clear()
+
+    return (chave if chave is not None else chave_ch), produtos
+
+
+def _with_fallback(func, xml_content):
+    try:
+        return func(xml_content)
+    except ET.ParseError:
+        # Mesmo tratamento do parser antigo: ignora bytes UTF-8 inválidos
+        if isinstance(xml_content, bytes):
+            return func(xml_content.decode('utf-8', errors='ignore'))
+        raise
+
+
+def _extract_chave(xml_content):
+    chave_ch = None
+    for event, elem in _iter_events(xml_content):
+        if event == 'start':
+            if elem.tag in TAG_INFNFE:
+                chave = _chave_from_id(elem.get('Id', ''))
+                if chave is not None:
+                    return chave
+        else:
+            if chave_ch is None and elem.tag in TAG_CHNFE:
+                chave_ch = only_digits(elem.text.strip() if elem.text else '')
+            elem.clear()
+    return chave_ch
+
+
+def parse_nfe(xml_content):
+    """Lê o XML uma única vez e retorna (chave, produtos)
+
+    Aceita bytes, str ou objeto com read(). Os produtos seguem o formato de
+    NFeAnalyzer.extract_products_from_xml, sem a classificação. Lança
+    ET.ParseError se o documento for inválido.
+    """
+    return _with_fallback(_parse, xml_content)
+
+
+def extract_chave(xml_content):
+    """Retorna apenas a chave, interrompendo a leitura no infNFe"""
+    return _with_fallback(_extract_chave, xml_content)
@@ -0,0 +1,102 @@
+# nfe_reconcile.py - Conciliação SEFAZ x XMLs em todas as categorias de notas
+import numpy as np
+import pandas as pd
+
+from nfe_sefaz import CATEGORIAS, AUTORIZADAS, CANCELADAS, DENEGADAS, ENTRADA
+
+# Grupos da conciliação: nome -> título
+BUCKETS = {
+    'autorizadas_com_xml': 'Autorizadas com XML',
+    'autorizadas_sem_xml': 'Autorizadas sem XML',
+    'xml_sem_sefaz': 'XML sem registro na SEFAZ',
+    'xml_canceladas': 'XML de nota cancelada',
+    'xml_denegadas': 'XML de nota denegada',
+    'entrada_com_xml': 'Entrada com XML',
+}
+
+# Grupos que indicam divergência (exportados como listas)
+DIVERGENCES = ['autorizadas_sem_xml', 'xml_sem_sefaz', 'xml_canceladas', 'xml_denegadas',
+               'entrada_com_xml']
+
+LIST_COLUMNS = ['Chave de Acesso', 'Situação', 'Valor']
+
+
+def _values(notas):
+    return np.fromiter((dados['valor'] for dados in notas.values()), dtype=np.float64, count=len(notas))
+
+
+class Reconciliation:
+    """Cruzamento das chaves da SEFAZ (por categoria) com as chaves dos XMLs
+
+    Todas as chaves são numeradas de uma vez (pd.factorize) e cada categoria
+    vira uma máscara booleana sobre essa numeração; os grupos saem de
+    operações entre máscaras, sem consulta chave a chave. As chaves seguem
+    a ordem da SEFAZ (autorizadas, canceladas, denegadas, entrada) e depois
+    a dos XMLs.
+
+    notas_sefaz é {categoria: {chave: dados}} como em NFeAnalyzer. O valor é
+    o da SEFAZ; para XMLs sem registro, xml_valor(chave) é usado se
+    informado.
+    """
+
+    def __init__(self, notas_sefaz, xml_chaves, xml_valor=None):
+        partes = [list(notas_sefaz.get(categoria, {})) for categoria in CATEGORIAS] + [list(xml_chaves)]
+        limites = np.cumsum([0] + [len(parte) for parte in partes])
+        todas = np.empty(limites[-1], dtype=object)
+        for inicio, parte in zip(limites, partes):
+            todas[inicio:inicio + len(parte)] = parte
+        # Numeração única de todas as chaves (hash em C, na ordem de aparição)
+        todos_codes, self.chaves = pd.factorize(todas)
+        n = len(self.chaves)
+        codes = [todos_codes[inicio:fim] for inicio, fim in zip(limites[:-1], limites[1:])]
+
+        self.valor = np.zeros(n, dtype=np.float64)
+        self.situacao = np.full(n, '', dtype=object)
+        membro = {}
+        # Da última para a primeira: com chave repetida, vale a primeira categoria
+        for categoria, linhas in reversed(list(zip(CATEGORIAS, codes))):
+            membro[categoria] = np.zeros(n, dtype=bool)
+            membro[categoria][linhas] = True
+            notas = notas_sefaz.get(categoria, {})
+            self.valor[linhas] = _values(notas)
+            self.situacao[linhas] = [dados['situacao'] for dados in notas.values()]
+        xml = np.zeros(n, dtype=bool)
+        xml[codes[-1]] = True
+
+        na_sefaz = membro[AUTORIZADAS] | membro[CANCELADAS] | membro[DENEGADAS] | membro[ENTRADA]
+        masks = {
+            'autorizadas_com_xml': membro[AUTORIZADAS] & xml,
+            'autorizadas_sem_xml': membro[AUTORIZADAS] & ~xml,
+            'xml_sem_sefaz': xml & ~na_sefaz,
+            'xml_canceladas': membro[CANCELADAS] & xml,
+            'xml_denegadas': membro[DENEGADAS] & xml,
+            'entrada_com_xml': membro[ENTRADA] & xml,
+        }
+        self.buckets = {name: np.flatnonzero(mask) for name, mask in masks.items()}
+
+        sem_sefaz = self.buckets['xml_sem_sefaz']
+        if xml_valor is not None and len(sem_sefaz):
+            self.valor[sem_sefaz] = [xml_valor(chave) for chave in self.chaves[sem_sefaz]]
+
+    def count(self, name):
+        return len(self.buckets[name])
+
+    def total(self, name):
+        return float(self.valor[self.buckets[name]].sum())
+
+    def summary(self):
+        """DataFrame com notas e valor de cada grupo"""
+        return pd.DataFrame({
+            'Conciliação': list(BUCKETS.values()),
+            'Notas': [self.count(name) for name in BUCKETS],
+            'Valor': [self.total(name) for name in BUCKETS],
+        })
+
+    def frame(self, name):
+        """Lista de um grupo: chave, situação na SEFAZ e valor"""
+        linhas = self.buckets[name]
+        return pd.DataFrame({
+            'Chave de Acesso': self.chaves[linhas],
+            'Situação': self.situacao[linhas],
+            'Valor': self.valor[linhas],
+        }, columns=LIST_COLUMNS)
@@ -0,0 +1,162 @@
+# nfe_sefaz.py - Leitura vetorizada do CSV de notas da SEFAZ
+import os
+
+import numpy as np
+import pandas as pd
+
+# Acima deste tamanho o CSV é lido em blocos de CHUNK_ROWS linhas
+CHUNK_THRESHOLD = 64 * 1024 * 1024
+CHUNK_ROWS = 200_000
+
+SEPARATORS = [',', ';', '\t']
+
+# Categorias em que cada nota é separada
+AUTORIZADAS = 'autorizadas'
+ENTRADA = 'entrada'
+CANCELADAS = 'canceladas'
+DENEGADAS = 'denegadas'
+CATEGORIAS = [AUTORIZADAS, CANCELADAS, DENEGADAS, ENTRADA]
+
+
+class SefazColumnsError(ValueError):
+    pass
+
+
+def find_columns(columns):
+    """Identifica as colunas de chave, situação, tipo de operação e valor"""
+    chave_col = None
+    situacao_col = None
+    tipo_op_col = None
+    valor_col = None
+
+    for col in columns:
+        col_clean = str(col).upper().replace(' ', '')
+        if 'CHAVE' in col_clean and 'ACESSO' in col_clean:
+            chave_col = col
+        elif 'SITUACAO' in col_clean or 'SITUAÇÃO' in col_clean:
+            situacao_col = col
+        elif 'TIPO' in col_clean and 'OPERACAO' in col_clean:
+            tipo_op_col = col
+        elif 'VALOR' in col_clean:
+            valor_col = col
+
+    return chave_col, situacao_col, tipo_op_col, valor_col
+
+
+def _file_size(csv_file):
+    if isinstance(csv_file, (str, os.PathLike)):
+        return os.path.getsize(csv_file)
+    if getattr(csv_file, 'size', None) is not None:
+        return csv_file.size
+    csv_file.seek(0, os.SEEK_END)
+    size = csv_file.tell()
+    csv_file.seek(0)
+    return size
+
+
+def _sample(csv_file, size=64 * 1024):
+    if isinstance(csv_file, (str, os.PathLike)):
+        with open(csv_file, 'rb') as f:
+            return f.read(size)
+    csv_file.seek(0)
+    sample = csv_file.read(size)
+    csv_file.seek(0)
+    return sample.encode('utf-8') if isinstance(sample, str) else sample
+
+
+def sniff_format(csv_file):
+    """Descobre separador e encoding a partir do início do arquivo"""
+    sample = _sample(csv_file)
+    try:
+        text = sample.decode('utf-8')
+        encoding = 'utf-8'
+    except UnicodeDecodeError as e:
+        # Corte no meio de um caractere multibyte no fim da amostra
+        if e.start >= len(sample) - 3:
+            text = sample[:e.start].decode('utf-8')
+            encoding = 'utf-8'
+        else:
+            text = sample.decode('latin-1')
+            encoding = 'latin-1'
+
+    header = text.splitlines()[0] if text else ''
+    # Primeiro separador com mais de 5 colunas; senão o que gera mais colunas
+    for sep in SEPARATORS:
+        if header.count(sep) + 1 > 5:
+            return sep, encoding
+    return max(SEPARATORS, key=header.count), encoding
+
+
+def normalize_frame(df, columns):
+    """Limpa chave/valor e atribui a categoria de cada linha
+
+    Retorna apenas as linhas com chave de 44 dígitos e categoria conhecida,
+    com as colunas chave, situacao, tipo_operacao, valor e categoria.
+    """
+    chave_col, situacao_col, tipo_op_col, valor_col = columns
+
+    chave = df[chave_col].fillna('').astype(str).str.replace(r'\D', '', regex=True)
+    situacao = df[situacao_col].fillna('').astype(str).str.strip()
+    if tipo_op_col is not None:
+        tipo_op = df[tipo_op_col].fillna('Saida').astype(str).str.strip()
+    else:
+        tipo_op = pd.Series('Saida', index=df.index)
+
+    if valor_col is not None:
+        valor_str = (df[valor_col].astype(str)
+                     .str.replace('R$', '', regex=False)
+                     .str.replace('.', '', regex=False)
+                     .str.replace(',', '.', regex=False)
+                     .str.strip())
+        valor = pd.to_numeric(valor_str, errors='coerce').fillna(0.0)
+    else:
+        valor = pd.Series(0.0, index=df.index)
+
+    situacao_upper = situacao.str.upper()
+    tipo_upper = tipo_op.str.upper()
+    autorizada = situacao_upper.str.contains('AUTORIZADA', regex=False)
+    saida = tipo_upper.str.contains('SAIDA', regex=False) | tipo_upper.str.contains('SAÍDA', regex=False)
+    cancelada = situacao_upper.str.contains('CANCELADA', regex=False)
+    denegada = situacao_upper.str.contains('DENEGADA', regex=False)
+
+    categoria = np.select(
+        [autorizada & saida, autorizada, cancelada, denegada],
+        [AUTORIZADAS, ENTRADA, CANCELADAS, DENEGADAS],
+        default=''
+    )
+
+    frame = pd.DataFrame({
+        'chave': chave,
+        'situacao': situacao,
+        'tipo_operacao': tipo_op,
+        'valor': valor,
+        'categoria': categoria
+    })
+    return frame[(chave.str.len() == 44) & (frame['categoria'] != '')]
+
+
+def _read(csv_file, sep, encoding, chunksize):
+    if not isinstance(csv_file, (str, os.PathLike)):
+        csv_file.seek(0)
+    reader = pd.read_csv(csv_file, sep=sep, encoding=encoding, dtype=str,
+                         chunksize=chunksize)
+    return reader if chunksize else [reader]
+
+
+def iter_sefaz_frames(csv_file, chunk_threshold=CHUNK_THRESHOLD, chunk_rows=CHUNK_ROWS,
+                      encoding=None):
+    """Gera os blocos normalizados do CSV (um único bloco se for pequeno)
+
+    Lança SefazColumnsError se as colunas essenciais não forem encontradas.
+    """
+    sep, sniffed_encoding = sniff_format(csv_file)
+    encoding = encoding or sniffed_encoding
+    chunksize = chunk_rows if _file_size(csv_file) > chunk_threshold else None
+
+    columns = None
+    for df in _read(csv_file, sep, encoding, chunksize):
+        if columns is None:
+            columns = find_columns(df.columns)
+            if not columns[0] or not columns[1]:
+                raise SefazColumnsError("Colunas essenciais não encontradas!")
+        yield normalize_frame(df, columns)
@@ -0,0 +1,331 @@
+# nfe_store.py - Armazenamento colunar dos produtos processados
+import os
+import shutil
+import sys
+import tempfile
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from nfe_xmlstore import spool_dir
+
+# Ordem das colunas (mesmas chaves dos antigos dicionários por produto)
+COLUMNS = [
+    'ncm', 'descricao', 'classificacao', 'quantidade', 'valor_unitario',
+    'valor_produto_xml', 'unidade', 'cfop', 'chave_nfe', 'valor_nota_sefaz',
+    'valor_produto_proporcional', 'status'
+]
+
+NUMERIC_COLUMNS = [
+    'quantidade', 'valor_unitario', 'valor_produto_xml', 'valor_nota_sefaz',
+    'valor_produto_proporcional'
+]
+
+CATEGORICAL_COLUMNS = ['classificacao', 'unidade', 'cfop', 'chave_nfe', 'status']
+
+STRING_COLUMNS = ['ncm', 'descricao']
+
+
+class GrowableArray:
+    """Array numpy que cresce por blocos (sem objetos Python por linha)
+
+    Depois de spill(path) os dados ficam num arquivo mapeado em memória
+    (np.memmap): o acesso continua o mesmo e o sistema lê/descarta as
+    páginas conforme o uso.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+        self.path = None
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed > len(self.data):
+            capacity = max(needed, len(self.data) * 2)
+            if self.path is not None:
+                self.data = self._map(capacity)
+                return
+            data = np.empty(capacity, dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            # Views já entregues continuam válidas no bloco anterior
+            self.data = data
+
+    def _map(self, capacity):
+        """Mapeia o arquivo com capacity posições (aumentando o arquivo se preciso)"""
+        with open(self.path, 'r+b') as f:
+            f.truncate(capacity * self.data.dtype.itemsize)
+        return np.memmap(self.path, dtype=self.data.dtype, mode='r+', shape=(capacity,))
+
+    def spill(self, path):
+        """Passa os dados para o arquivo path; as próximas linhas também vão para o disco"""
+        data = self.data
+        open(path, 'wb').close()
+        self.path = path
+        self.data = self._map(max(len(data), 1))
+        self.data[:self.size] = data[:self.size]
+
+    @property
+    def memory_bytes(self):
+        """Bytes ocupados em memória (zero depois do spill)"""
+        return 0 if self.path is not None else self.data.nbytes
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        self._reserve(len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def fill(self, value, count):
+        self._reserve(count)
+        self.data[self.size:self.size + count] = value
+        self.size += count
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class CategoricalColumn:
+    """Coluna categórica: códigos int32 + lista de valores distintos"""
+
+    def __init__(self):
+        self.codes = GrowableArray(np.int32)
+        self.categories = []
+        self._index = {}
+
+    def code_of(self, value, create=True):
+        code = self._index.get(value)
+        if code is None:
+            if not create:
+                return -1
+            code = self._index[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def extend(self, values):
+        self.codes.extend([self.code_of(value) for value in values])
+
+    def fill(self, value, count):
+        self.codes.fill(self.code_of(value), count)
+
+    def view(self):
+        return self.codes.view()
+
+    def to_categorical(self, rows=slice(None)):
+        return pd.Categorical.from_codes(self.view()[rows], categories=self.categories)
+
+
+class StringColumn(CategoricalColumn):
+    """Coluna de texto com os códigos em disco, usada no lugar da lista de strings
+
+    Mantém a interface de lista usada pelas exportações (len, índice, slice
+    e array de índices); em memória ficam só os valores distintos.
+    """
+
+    def __len__(self):
+        return self.codes.size
+
+    def __getitem__(self, index):
+        codes = self.view()[index]
+        if np.ndim(codes) == 0:
+            return self.categories[codes]
+        if len(self.categories) and len(codes):
+            return np.array(self.categories, dtype=object)[codes].tolist()
+        return []
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def factorize(self):
+        """(código por linha, valores) como pd.factorize: ordem de aparição, sem valores sem linhas"""
+        codes, used = pd.factorize(self.view())
+        return codes, [self.categories[code] for code in used.tolist()]
+
+
+def _take_codes(target, column, rows):
+    """Copia para target (vazia) os valores de column e os códigos das linhas"""
+    target.categories = list(column.categories)
+    target._index = dict(column._index)
+    target.codes.extend(column.view()[rows])
+
+
+class ProductStore:
+    """Produtos processados em colunas tipadas
+
+    Substitui a lista de dicionários de NFeAnalyzer.processed_data: valores
+    numéricos ficam em arrays float64, classificação/CFOP/unidade/chave/status
+    em códigos categóricos e NCMs/descrições como strings compartilhadas.
+    """
+
+    def __init__(self):
+        self.numeric = {col: GrowableArray(np.float64) for col in NUMERIC_COLUMNS}
+        self.categorical = {col: CategoricalColumn() for col in CATEGORICAL_COLUMNS}
+        self.strings = {col: [] for col in STRING_COLUMNS}
+        self._descricoes = {}
+        self.spill_dir = None
+
+    def __len__(self):
+        return len(self.strings['ncm'])
+
+    @property
+    def spilled(self):
+        return self.spill_dir is not None
+
+    def spill(self, directory=None):
+        """Move todas as colunas para arquivos numa pasta temporária (np.memmap)
+
+        Números e códigos passam a ser lidos do disco; NCMs e descrições
+        viram códigos (StringColumn). Leitura, agregação, exportação e novas
+        linhas seguem iguais. A pasta é apagada junto com o store.
+        """
+        if self.spilled:
+            return
+        self.spill_dir = tempfile.mkdtemp(prefix='nfe-produtos-', dir=directory or spool_dir())
+        weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+        for col, array in self.numeric.items():
+            array.spill(os.path.join(self.spill_dir, f"{col}.f8"))
+        for col, column in self.categorical.items():
+            column.codes.spill(os.path.join(self.spill_dir, f"{col}.i4"))
+        for col in STRING_COLUMNS:
+            column = StringColumn()
+            column.codes.spill(os.path.join(self.spill_dir, f"{col}.i4"))
+            values = self.strings[col]
+            if values:
+                codes, uniques = pd.factorize(np.array(values, dtype=object))
+                column.categories = uniques.tolist()
+                column._index = {value: code for code, value in enumerate(column.categories)}
+                column.codes.extend(codes)
+            self.strings[col] = column
+
+    @property
+    def memory_bytes(self):
+        """Estimativa dos bytes das colunas em memória (os textos são os mesmos objetos dos XMLs)"""
+        total = sum(array.memory_bytes for array in self.numeric.values())
+        total += sum(column.codes.memory_bytes for column in self.categorical.values())
+        for values in self.strings.values():
+            total += values.codes.memory_bytes if isinstance(values, StringColumn) else 8 * len(values)
+        return total
+
+    @property
+    def disk_bytes(self):
+        if not self.spilled:
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.spill_dir))
+
+    def append_note(self, chave, valor_nota_sefaz, produtos, status):
+        """Adiciona os produtos (já classificados) de uma nota"""
+        count = len(produtos)
+        if not count:
+            return
+        valor_proporcional = valor_nota_sefaz / count
+
+        self.strings['ncm'].extend(sys.intern(p['ncm']) for p in produtos)
+        self.strings['descricao'].extend(
+            self._descricoes.setdefault(p['descricao'], p['descricao']) for p in produtos)
+
+        for col in ('quantidade', 'valor_unitario', 'valor_produto_xml'):
+            self.numeric[col].extend([p[col] for p in produtos])
+        self.numeric['valor_nota_sefaz'].fill(valor_nota_sefaz, count)
+        self.numeric['valor_produto_proporcional'].fill(valor_proporcional, count)
+
+        for col in ('classificacao', 'unidade', 'cfop'):
+            self.categorical[col].extend([p[col] for p in produtos])
+        self.categorical['chave_nfe'].fill(chave, count)
+        self.categorical['status'].fill(status, count)
+
+    def column(self, name, rows=slice(None)):
+        """Coluna como array numpy, Categorical ou lista de strings
+
+        rows é um slice ou um array de índices de linhas.
+        """
+        if name in self.numeric:
+            return self.numeric[name].view()[rows]
+        if name in self.categorical:
+            return self.categorical[name].to_categorical(rows)
+        values = self.strings[name]
+        if isinstance(rows, slice) or isinstance(values, StringColumn):
+            return values[rows]
+        return [values[i] for i in np.asarray(rows).tolist()]
+
+    def string_codes(self, name):
+        """(código por linha, valores distintos) da coluna de texto, como pd.factorize"""
+        values = self.strings[name]
+        if isinstance(values, StringColumn):
+            return values.factorize()
+        codes, uniques = pd.factorize(np.array(values, dtype=object))
+        return codes, uniques.tolist()
+
+    def to_dataframe(self, columns=None, rows=slice(None)):
+        """DataFrame montado direto das colunas (sem dicionários por linha)"""
+        columns = columns or COLUMNS
+        return pd.DataFrame({col: self.column(col, rows) for col in columns}, columns=columns)
+
+    def totals(self, by, value='valor_produto_proporcional'):
+        """{categoria: (quantidade, soma de value)} em uma única passada"""
+        column = self.categorical[by]
+        n = len(column.categories)
+        codes = column.view()
+        counts = np.bincount(codes, minlength=n)
+        sums = np.bincount(codes, weights=self.numeric[value].view(), minlength=n)
+        # Categorias sem linhas (ex.: notas removidas) ficam de fora
+        return {cat: (int(counts[i]), float(sums[i]))
+                for i, cat in enumerate(column.categories) if counts[i]}
+
+    def total(self, value='valor_produto_proporcional'):
+        return float(self.numeric[value].view().sum())
+
+    def take(self, rows):
+        """Novo ProductStore com as linhas (array de índices) na ordem dada
+
+        Um store em disco gera outro em disco, sem montar as colunas em memória.
+        """
+        store = ProductStore()
+        if self.spilled:
+            store.spill(os.path.dirname(self.spill_dir))
+        for col, array in self.numeric.items():
+            store.numeric[col].extend(array.view()[rows])
+        for col, column in self.categorical.items():
+            _take_codes(store.categorical[col], column, rows)
+        for col, values in self.strings.items():
+            if isinstance(values, StringColumn):
+                _take_codes(store.strings[col], values, rows)
+            else:
+                store.strings[col] = [values[i] for i in rows.tolist()]
+        store._descricoes = self._descricoes
+        return store
+
+    def relabel(self, column, source, func):
+        """Recalcula a coluna categórica aplicando func a cada valor distinto de source
+
+        Ex.: relabel('classificacao', 'ncm', classify) reclassifica todos os
+        produtos chamando classify uma vez por NCM distinto.
+        """
+        if not len(self):
+            return
+        source_codes, uniques = self.string_codes(source)
+        target = self.categorical[column]
+        new_codes = np.array([target.code_of(func(value)) for value in uniques], dtype=np.int32)
+        target.codes.data[:len(self)] = new_codes[source_codes]
+
+    def __iter__(self):
+        """Compatibilidade: percorre os produtos como dicionários"""
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('índice fora do intervalo')
+        item = {}
+        for col in COLUMNS:
+            if col in self.numeric:
+                item[col] = float(self.numeric[col].data[index])
+            elif col in self.categorical:
+                categorical = self.categorical[col]
+                item[col] = categorical.categories[categorical.codes.data[index]]
+            else:
+                item[col] = self.strings[col][index]
+        return item
@@ -0,0 +1,209 @@
+# nfe_watch.py - Ingestão de uma pasta de XMLs com índice persistente dos arquivos
+import os
+import sqlite3
+import threading
+
+from nfe_cache import default_cache_dir, fingerprint
+from nfe_parallel import parse_many
+
+# Extensões lidas da pasta monitorada
+WATCH_EXTENSIONS = ('.xml',)
+
+# Linhas gravadas por transação no índice
+_BATCH = 5000
+
+
+def scan_tree(directory, extensions=WATCH_EXTENSIONS):
+    """Gera (caminho, mtime_ns, tamanho) dos arquivos da árvore (os.scandir, sem ler conteúdo)"""
+    pendentes = [directory]
+    while pendentes:
+        try:
+            entries = os.scandir(pendentes.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pendentes.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_mtime_ns, stat.st_size
+                except OSError:
+                    continue
+
+
+class FileIndex:
+    """Índice persistente (SQLite) dos arquivos já lidos de cada pasta
+
+    Guarda caminho, mtime, tamanho, hash do conteúdo e chave da nota. Um
+    arquivo com o mesmo mtime e tamanho não é lido de novo: os produtos vêm
+    do NoteCache pelo hash.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS arquivos (
+                    pasta TEXT NOT NULL,
+                    caminho TEXT NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    tamanho INTEGER NOT NULL,
+                    hash TEXT,
+                    chave TEXT,
+                    PRIMARY KEY (pasta, caminho)
+                )""")
+
+    @classmethod
+    def default(cls):
+        return cls(os.path.join(default_cache_dir(), 'arquivos.sqlite'))
+
+    def load(self, pasta):
+        """{caminho: (mtime, tamanho, hash, chave)} dos arquivos conhecidos da pasta"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT caminho, mtime, tamanho, hash, chave FROM arquivos WHERE pasta = ?', (pasta,))
+            return {caminho: tuple(resto) for caminho, *resto in rows}
+
+    def put_many(self, pasta, rows):
+        """Grava [(caminho, mtime, tamanho, hash, chave)]"""
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?, ?, ?)',
+                                   [(pasta,) + tuple(row) for row in rows])
+
+    def delete_many(self, pasta, caminhos):
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM arquivos WHERE pasta = ? AND caminho = ?',
+                                   [(pasta, caminho) for caminho in caminhos])
+
+    def clear(self, pasta=None):
+        with self._lock, self._conn:
+            if pasta is None:
+                self._conn.execute('DELETE FROM arquivos')
+            else:
+                self._conn.execute('DELETE FROM arquivos WHERE pasta = ?', (pasta,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return b''
+
+
+class FolderWatcher:
+    """Mantém um NFeAnalyzer em dia com uma pasta de XMLs (ex.: onde o ERP grava as notas)
+
+    Cada refresh percorre a árvore só com stat; arquivos novos ou alterados
+    (mtime/tamanho) são lidos e processados em paralelo, os inalterados
+    entram com os produtos do NoteCache e os removidos saem da base. Os
+    XMLs não são copiados: a base do analyzer guarda só o caminho.
+    """
+
+    def __init__(self, directory, analyzer, index=None, extensions=WATCH_EXTENSIONS):
+        self.directory = os.path.abspath(directory)
+        self.analyzer = analyzer
+        self.index = index if index is not None else FileIndex.default()
+        self.extensions = extensions
+        # Chave de cada arquivo já registrado no analyzer e {arquivo: hash} por chave
+        # (o último registrado é o que o analyzer lê)
+        self._registrados = {}
+        self._arquivos_por_chave = {}
+
+    def refresh(self, progress=None):
+        """Sincroniza a pasta com o analyzer e devolve as contagens da atualização"""
+        analyzer = self.analyzer
+        conhecidos = self.index.load(self.directory)
+        atuais = {caminho: (mtime, tamanho)
+                  for caminho, mtime, tamanho in scan_tree(self.directory, self.extensions)}
+        novos = [caminho for caminho in atuais if caminho not in conhecidos]
+        alterados = [caminho for caminho, stat in atuais.items()
+                     if caminho in conhecidos and conhecidos[caminho][:2] != stat]
+        removidos = [caminho for caminho in set(conhecidos) | set(self._registrados) if caminho not in atuais]
+        for caminho in removidos + alterados:
+            self._forget(caminho)
+
+        # Inalterados ainda fora do analyzer: produtos do cache, sem abrir o arquivo
+        inalterados = [caminho for caminho, stat in atuais.items() if caminho not in self._registrados
+                       and caminho in conhecidos and conhecidos[caminho][:2] == stat]
+        ler = novos + alterados
+        com_chave = [caminho for caminho in inalterados if conhecidos[caminho][3]]
+        encontrados = {}
+        if com_chave and analyzer.note_cache is not None:
+            encontrados = analyzer.note_cache.get_many([conhecidos[caminho][2] for caminho in com_chave])
+        for caminho in inalterados:
+            _, _, hash_, chave = conhecidos[caminho]
+            if not chave:
+                self._registrados[caminho] = None
+            elif hash_ in encontrados:
+                self._register(caminho, *encontrados[hash_], hash_)
+            else:
+                # Fora do cache (desativado ou descartado): o arquivo é lido de novo
+                ler.append(caminho)
+
+        sem_chave = 0
+        linhas = []
+        resultados = parse_many(((fingerprint(content), content) for content in map(_read, ler)),
+                                analyzer.workers, cache=analyzer.note_cache, hashed=True)
+        for feitos, (caminho, ((hash_, _), (chave, produtos))) in enumerate(zip(ler, resultados), start=1):
+            if chave and len(chave) == 44:
+                self._register(caminho, chave, produtos, hash_)
+            else:
+                chave = None
+                sem_chave += 1
+                self._registrados[caminho] = None
+            linhas.append((caminho,) + atuais[caminho] + (hash_, chave))
+            if len(linhas) >= _BATCH:
+                self.index.put_many(self.directory, linhas)
+                linhas = []
+            if progress is not None:
+                progress.update(feitos, len(ler), f"Lendo pasta... {feitos}/{len(ler)}")
+        if linhas:
+            self.index.put_many(self.directory, linhas)
+        self.index.delete_many(self.directory, removidos)
+        analyzer.diagnostics.count('xml_sem_chave', sem_chave)
+
+        return {
+            'arquivos': len(atuais),
+            'notas': sum(map(len, self._arquivos_por_chave.values())),
+            'novos': len(novos),
+            'alterados': len(alterados),
+            'removidos': len(removidos),
+            'lidos': len(ler),
+            'sem_chave': sem_chave,
+        }
+
+    def _register(self, caminho, chave, produtos, hash_):
+        self.analyzer.add_xml_file(chave, produtos, caminho, hash_)
+        self._registrados[caminho] = chave
+        self._arquivos_por_chave.setdefault(chave, {})[caminho] = hash_
+
+    def _forget(self, caminho):
+        """Tira do analyzer a nota de um arquivo removido, se nenhum outro a fornece
+
+        Se o analyzer lia justamente esse arquivo, passa a ler o último
+        registrado entre os que restam (produtos extraídos de novo na análise).
+        """
+        chave = self._registrados.pop(caminho, None)
+        if not chave:
+            return
+        caminhos = self._arquivos_por_chave[chave]
+        atual = next(reversed(caminhos)) == caminho
+        del caminhos[caminho]
+        if not caminhos:
+            del self._arquivos_por_chave[chave]
+            self.analyzer.forget_xml(chave)
+        elif atual:
+            restante = next(reversed(caminhos))
+            self.analyzer.add_xml_file(chave, None, restante, caminhos[restante])
@@ -0,0 +1,118 @@
+# nfe_xmlstore.py - XMLs originais gravados em disco, lidos só quando necessários
+import os
+import tempfile
+import threading
+import zlib
+
+# Compressão rápida: XMLs de NFe encolhem bastante mesmo no nível mais baixo
+COMPRESS_LEVEL = 1
+
+
+def spool_dir():
+    """Pasta dos arquivos temporários (NFE_SPOOL_DIR ou a pasta temporária do sistema)"""
+    return os.environ.get('NFE_SPOOL_DIR') or tempfile.gettempdir()
+
+
+class XMLStore:
+    """Dicionário chave -> conteúdo do XML com os dados em um arquivo temporário
+
+    Cada documento é compactado e acrescentado ao fim do arquivo; em memória
+    fica apenas chave -> (posição, tamanho). A leitura descompacta só o
+    documento pedido, que pode ser descartado logo depois. O arquivo é
+    anônimo e some ao fechar a base (ou ao encerrar o processo). XMLs que já
+    estão em disco (pasta monitorada) entram com add_file e guardam só o
+    caminho; se o arquivo sumir antes da leitura, o conteúdo vem vazio
+    (contado em missing_files) em vez de interromper a análise.
+    """
+
+    def __init__(self, directory=None, level=COMPRESS_LEVEL):
+        self.directory = directory
+        self.level = level
+        self._index = {}
+        self._file = None
+        self._size = 0
+        self.raw_bytes = 0
+        self.missing_files = 0
+        self._lock = threading.Lock()
+
+    def _spool(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix='nfe-xmls-', dir=self.directory or spool_dir())
+        return self._file
+
+    def __setitem__(self, chave, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        blob = zlib.compress(content, self.level)
+        with self._lock:
+            spool = self._spool()
+            spool.seek(self._size)
+            spool.write(blob)
+            # Um XML substituído continua no arquivo, apenas sem entrada no índice
+            self._index[chave] = (self._size, len(blob))
+            self._size += len(blob)
+            self.raw_bytes += len(content)
+
+    def add_file(self, chave, path):
+        """Registra um XML que continua no próprio arquivo (lido só quando pedido)"""
+        with self._lock:
+            self._index[chave] = os.fspath(path)
+
+    def __delitem__(self, chave):
+        # O espaço no arquivo temporário só é liberado em clear()
+        with self._lock:
+            del self._index[chave]
+
+    def __getitem__(self, chave):
+        entry = self._index[chave]
+        if isinstance(entry, str):
+            try:
+                with open(entry, 'rb') as f:
+                    return f.read()
+            except OSError:
+                # Apagado depois do registro: a próxima leitura da pasta remove a nota
+                self.missing_files += 1
+                return b''
+        offset, size = entry
+        with self._lock:
+            self._file.seek(offset)
+            blob = self._file.read(size)
+        return zlib.decompress(blob)
+
+    def get(self, chave, default=None):
+        try:
+            return self[chave]
+        except KeyError:
+            return default
+
+    def __contains__(self, chave):
+        return chave in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def keys(self):
+        return list(self._index)
+
+    @property
+    def disk_bytes(self):
+        """Bytes ocupados no disco (inclui XMLs substituídos)"""
+        return self._size
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._size = 0
+            self.raw_bytes = 0
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    close = clear
+
+    def __del__(self):
+        if self._file is not None:
+            self._file.close()